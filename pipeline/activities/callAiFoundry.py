@@ -2,25 +2,28 @@ import azure.durable_functions as df
 
 import logging
 import os
-from pipelineUtils.prompts import load_prompts
+from pipelineUtils.prompts import load_prompts, get_prompt_version
 from pipelineUtils.blob_functions import get_blob_content, write_to_blob
-from pipelineUtils.azure_openai import run_prompt
+from pipelineUtils.azure_openai import run_structured_prompt
+from pipelineUtils.errors import to_pipeline_error
 import json
 
 name = "callAoai"
 bp = df.Blueprint()
 
-@bp.function_name(name)
-@bp.activity_trigger(input_name="inputData")
-def run(inputData: dict):
+def call_aoai(inputData: dict):
     """
     Calls the Azure OpenAI service with the provided text result.
+
+    The output is validated (and repaired or re-asked if needed) by `run_structured_prompt`.
     
     Args:
         text_result (str): The text result to be processed by the Azure OpenAI service.
     
     Returns:
-        str: The response from the Azure OpenAI service.
+        dict: `json_str`, the response from the Azure OpenAI service as valid JSON,
+            `prompt_version`, the version of the prompts that produced it, and `partial`, whether
+            the output was cut off at the token limit.
     """
     try:
       # Load the prompt
@@ -32,15 +35,20 @@ def run(inputData: dict):
       full_user_prompt = prompt_json['user_prompt'] + "\n\n" + text_result
       # Call the Azure OpenAI service
       logging.info(f"callAoai.py: Full user prompt: {full_user_prompt}")
-      response_content = run_prompt(instance_id, prompt_json['system_prompt'], full_user_prompt)
-      if response_content.startswith('```json') and response_content.endswith('```'):
-        response_content = response_content.strip('`')
-        response_content = response_content.replace('json', '', 1).strip()
-      
-      json_str = response_content
-      # Return the response
-      return json_str
+      json_str, partial = run_structured_prompt(instance_id, prompt_json, full_user_prompt)
+      # Return the response with the prompt version it was produced with, for the output metadata
+      return {
+          "json_str": json_str,
+          "prompt_version": get_prompt_version(prompt_json),
+          "partial": partial
+      }
   
     except Exception as e:
         logging.error(f"Error processing Sub Orchestration (callAoai): {instance_id}: {e}")
-        raise  # Re-raise to allow Durable Functions to retry
\ No newline at end of file
+        raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
+
+
+@bp.function_name(name)
+@bp.activity_trigger(input_name="inputData")
+def run(inputData: dict):
+    return call_aoai(inputData)
@@ -8,21 +8,30 @@ import json
 import fitz # PyMuPDF
 from PyPDF2 import PdfReader, PdfWriter  # 👈 for PDF trimming
 import logging
+import os
 
 from pipelineUtils.prompts import load_prompts
-from pipelineUtils.blob_functions import get_blob_content, write_to_blob
-from pipelineUtils.azure_openai import run_prompt
+from pipelineUtils.blob_functions import get_blob_content, write_to_blob, normalize_blob_name
+from pipelineUtils.azure_openai import run_structured_prompt
+from pipelineUtils.errors import PermanentError, to_pipeline_error
 
 name = "callAoaiMultiModal"
+
+# Image types that can be sent to the model as-is, with their MIME types
+IMAGE_MIME_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
 bp = df.Blueprint()
 
 def convert_to_base64_images(blob_input: dict):
-    """Convert PDF pages or PNG image to base64-encoded images."""
+    """Convert PDF pages (rendered as PNG) or a PNG/JPEG image to base64-encoded images."""
     blob_name = blob_input.get("name")
     container = blob_input.get('container')
     blob_content = get_blob_content(
         container_name=container,
-        blob_path=blob_name
+        blob_path=normalize_blob_name(container, blob_name)
     )
 
     if blob_name.lower().endswith('.pdf'):
@@ -44,16 +53,19 @@ def convert_to_base64_images(blob_input: dict):
             logging.error(f"[Silver] PDF trimming or encoding failed: {e}")
             raise
 
-    elif blob_name.lower().endswith('.png'):
+    elif os.path.splitext(blob_name.lower())[1] in IMAGE_MIME_TYPES:
         
-        # Process PNG: Directly encode the image to base64
+        # Process PNG/JPEG: Directly encode the image to base64
         try:
             b64 = base64.b64encode(blob_content).decode("utf-8")
             base64_images = [b64]
 
         except Exception as e:
-            logging.error(f"[Silver] PNG encoding failed: {e}")
+            logging.error(f"[Silver] Image encoding failed: {e}")
             raise
+
+    else:
+        raise PermanentError(f"Multi-modal processing does not support {os.path.splitext(blob_name)[1]} files: {blob_name}")
     return base64_images
 
 @bp.function_name(name)
@@ -64,21 +76,25 @@ def run(blob_input: dict):
     container = blob_input.get('container')
     instance_id = blob_input.get('instance_id', '')
 
-    blob_content = get_blob_content(
-        container_name=container,
-        blob_path=blob_name
-    )
-
-
-    base64_images = convert_to_base64_images(blob_input)
-
-    prompt_json = load_prompts()
-
-    system_prompt = prompt_json['system_prompt']
-
-    full_user_prompt = (
-        f"{prompt_json['user_prompt']}\n\n"
-    )
-    response_content = run_prompt(instance_id, system_prompt, full_user_prompt, base64_images=base64_images)
+    try:
+        base64_images = convert_to_base64_images(blob_input)
+        # PDF pages are rendered to PNG
+        image_mime_type = IMAGE_MIME_TYPES.get(os.path.splitext(blob_name.lower())[1], "image/png")
+
+        prompt_json = load_prompts()
+
+        full_user_prompt = (
+            f"{prompt_json['user_prompt']}\n\n"
+        )
+        response_content, partial = run_structured_prompt(
+            instance_id, prompt_json, full_user_prompt,
+            base64_images=base64_images, image_mime_type=image_mime_type
+        )
+        if partial:
+            logging.warning(f"callAoaiMultiModal: Output for {blob_name} was cut off at the token limit")
+
+    except Exception as e:
+        logging.error(f"Error processing Sub Orchestration (callAoaiMultiModal): {instance_id}: {e}")
+        raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
 
     return response_content
\ No newline at end of file
@@ -0,0 +1,54 @@
+import azure.durable_functions as df
+import logging
+import json
+from datetime import datetime, timezone
+
+from pipelineUtils.blob_functions import get_blob_content, write_to_blob, delete_blob, normalize_blob_name
+from pipelineUtils.errors import to_pipeline_error
+
+from configuration import Configuration
+config = Configuration()
+
+QUARANTINE_CONTAINER = config.get_value("QUARANTINE_CONTAINER", "quarantine")
+
+name = "quarantineBlob"
+bp = df.Blueprint()
+
+@bp.function_name(name)
+@bp.activity_trigger(input_name="args")
+def quarantine_blob(args: dict):
+  """
+  Moves a permanently failing blob to the quarantine container with a diagnostic record.
+  Args:
+      args (dict): A dictionary containing the blob input, the orchestration instance id and
+          the error (activity, category, message) that caused the quarantine.
+  """
+  blob_input = args['blob']
+  try:
+      container = blob_input['container']
+      blob_path = normalize_blob_name(container, blob_input['name'])
+      quarantine_path = f"{container}/{blob_path}"
+
+      content = get_blob_content(container, blob_path)
+      write_to_blob(QUARANTINE_CONTAINER, quarantine_path, content)
+
+      diagnostic = {
+          "blob": blob_input,
+          "instance_id": args.get('instance_id'),
+          "error": args.get('error'),
+          "quarantined_at": datetime.now(timezone.utc).isoformat()
+      }
+      diagnostic_path = f"{quarantine_path}.error.json"
+      write_to_blob(QUARANTINE_CONTAINER, diagnostic_path, json.dumps(diagnostic, indent=2).encode('utf-8'))
+
+      # Remove the source last so a failure above leaves the original in place
+      delete_blob(container, blob_path)
+      logging.info(f"quarantineBlob.py: Moved {container}/{blob_path} to {QUARANTINE_CONTAINER}/{quarantine_path}")
+      return {
+          "quarantine_container": QUARANTINE_CONTAINER,
+          "quarantine_blob": quarantine_path,
+          "diagnostic_blob": diagnostic_path
+      }
+  except Exception as e:
+      logging.error(f"Error quarantining blob {blob_input}: {e}")
+      raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
@@ -1,7 +1,10 @@
 import azure.durable_functions as df
 import logging
-from pipelineUtils.blob_functions import list_blobs, get_blob_content, write_to_blob
+from pipelineUtils.blob_functions import list_blobs, get_blob_content, write_to_blob, normalize_blob_name
 from pipelineUtils import get_month_date
+from pipelineUtils.errors import PermanentError, to_pipeline_error
+from pipelineUtils.token_reduction import TokenReductionOptions, blocks_from_analyze_result, reduce_tokens
+from pipelineUtils.local_extraction import LOCAL_EXTENSIONS, LocalExtractionOptions, extract_local, build_pdf_subset
 # Libraries used in the future Document Processing client code
 from azure.identity import DefaultAzureCredential
 from azure.ai.documentintelligence import DocumentIntelligenceClient
@@ -10,35 +13,84 @@ import base64
 import json
 import os
 import requests
+from dataclasses import replace
 
 from configuration import Configuration
 config = Configuration()
 
+# Read at import rather than per document
+# prebuilt-layout adds paragraph roles and tables, which improve boilerplate removal
+DOC_INTEL_MODEL = config.get_value("DOC_INTEL_MODEL", "prebuilt-read")
+TOKEN_REDUCTION_OPTIONS = TokenReductionOptions.from_config(config)
+LOCAL_EXTRACTION_OPTIONS = LocalExtractionOptions.from_config(config)
+
 
 name = "runDocIntel"
 bp = df.Blueprint()
 
-def normalize_blob_name(container: str, raw_name: str) -> str:
-    """Strip container prefix if included in the name."""
-    if raw_name.startswith(container + "/"):
-        return raw_name[len(container) + 1:]
-    return raw_name
+def analyze_document(content: bytes, model_id: str, reduction_options: TokenReductionOptions):
+    """Run Document Intelligence on the content and return its text blocks."""
+    client = DocumentIntelligenceClient(
+        endpoint=config.get_value("AI_SERVICES_ENDPOINT"), credential=config.credential
+    )
+    logging.info(f"Starting analyze document: {content[:100]}...")  # Log the first 100 bytes of the file for debugging
+    poller = client.begin_analyze_document(
+        # AnalyzeDocumentRequest Class: https://learn.microsoft.com/en-us/python/api/azure-ai-documentintelligence/azure.ai.documentintelligence.models.analyzedocumentrequest?view=azure-python
+        model_id, AnalyzeDocumentRequest(bytes_source=content)
+    )
+
+    result: AnalyzeResult = poller.result()
+    logging.info(f"Analyze document completed with status: {result}")
+    return blocks_from_analyze_result(result, reduction_options)
+
+
+def extract_text(blob_name: str, content: bytes) -> str:
+    """
+    Extract the text of a document, preferring the local text layer over Document Intelligence.
+
+    Born-digital PDF pages and Office files are extracted in-process; only PDF pages without a
+    text layer (or Office files with no text at all) are sent to Document Intelligence. OCR
+    results are merged back in page order before token reduction.
+    """
+    model_id = DOC_INTEL_MODEL
+    reduction_options = TOKEN_REDUCTION_OPTIONS
+    extraction_options = LOCAL_EXTRACTION_OPTIONS
+    extension = os.path.splitext(blob_name)[1].lower().lstrip('.')
+
+    if extraction_options.enabled and extension in LOCAL_EXTENSIONS:
+        local_result = extract_local(extension, content, extraction_options)
+        blocks = local_result.blocks
+
+        if extension == "pdf" and local_result.ocr_pages:
+            # Scanned PDFs (no page has a text layer) are sent as-is
+            subset = build_pdf_subset(content, local_result.ocr_pages) if blocks else content
+            ocr_blocks = analyze_document(subset, model_id, reduction_options)
+            for block in ocr_blocks:
+                # Page numbers in the subset are 1-based positions in ocr_pages
+                block.page = local_result.ocr_pages[block.page - 1] if block.page else local_result.ocr_pages[0]
+            # Stable sort keeps the reading order within each page
+            blocks = sorted(blocks + ocr_blocks, key=lambda block: block.page)
+        elif local_result.ocr_pages:
+            blocks = analyze_document(content, model_id, reduction_options)
+        elif not local_result.paginated:
+            # Sheets and slides repeat column headers and titles that are content, not page furniture
+            reduction_options = replace(reduction_options, remove_page_boilerplate=False)
+    else:
+        blocks = analyze_document(content, model_id, reduction_options)
+
+    text, reduction_stats = reduce_tokens(blocks, reduction_options)
+    logging.info(f"Token reduction for {blob_name}: {reduction_stats}")
+    if not text.strip():
+        raise PermanentError(f"No text could be extracted from {blob_name}")
+    return text
 
-@bp.function_name(name)
-@bp.activity_trigger(input_name="blob_input")
-def extract_text_from_blob(blob_input: dict):
+
+def extract_blob_text(blob_input: dict):
 
     blob_name = blob_input.get('name')
     container = blob_input.get('container')
 
-    endpoint = config.get_value("AI_SERVICES_ENDPOINT")
-
     try:
-    
-        client = DocumentIntelligenceClient(
-            endpoint=endpoint, credential=config.credential
-        )
-
         normalized_blob_name = normalize_blob_name(container, blob_name)
         logging.info(f"Normalized Blob Name: {normalized_blob_name}")
         blob_content = get_blob_content(
@@ -46,20 +98,14 @@ def extract_text_from_blob(blob_input: dict):
             blob_path=normalized_blob_name
         )
 
-        
-        logging.info(f"Starting analyze document: {blob_content[:100]}...")  # Log the first 50 bytes of the file for debugging}")
-        poller = client.begin_analyze_document(
-            # AnalyzeDocumentRequest Class: https://learn.microsoft.com/en-us/python/api/azure-ai-documentintelligence/azure.ai.documentintelligence.models.analyzedocumentrequest?view=azure-python
-            "prebuilt-read", AnalyzeDocumentRequest(bytes_source=blob_content)
-        )
-        
-        result: AnalyzeResult = poller.result()
-        logging.info(f"Analyze document completed with status: {result}")
-        if result.paragraphs:    
-            paragraphs = "\n".join([paragraph.content for paragraph in result.paragraphs])            
-        
-        return paragraphs
-      
+        return extract_text(normalized_blob_name, blob_content)
+
     except Exception as e:
         logging.error(f"Error processing {blob_input}: {e}")
-        raise  # Re-raise to allow Durable Functions to retry
+        raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
+
+
+@bp.function_name(name)
+@bp.activity_trigger(input_name="blob_input")
+def extract_text_from_blob(blob_input: dict):
+    return extract_blob_text(blob_input)
@@ -1,89 +1,340 @@
 import azure.durable_functions as df
 
+import io
+import os
+import json
+import wave
 import requests
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from configuration import Configuration
+from pipelineUtils.blob_functions import get_blob_content, get_blob_range, normalize_blob_name
+from pipelineUtils.errors import PermanentError, to_pipeline_error
+
+config = Configuration()
+
+# Resolved once per worker; settings missing from App Configuration cost a retry cycle on every read
+SPEECH_LOCALES = config.read_env_list("SPEECH_LOCALES") or ["en-US"]
+SPEECH_SEGMENT_THRESHOLD_SECONDS = int(config.get_value("SPEECH_SEGMENT_THRESHOLD_SECONDS", "600"))
+SPEECH_SEGMENT_SECONDS = int(config.get_value("SPEECH_SEGMENT_SECONDS", "300"))
+SPEECH_MAX_CONCURRENT_SEGMENTS = int(config.get_value("SPEECH_MAX_CONCURRENT_SEGMENTS", "8"))
 
 name = "speechToText"
+batch_submit_name = "speechToTextBatchSubmit"
+batch_status_name = "speechToTextBatchStatus"
+batch_collect_name = "speechToTextBatchCollect"
 bp = df.Blueprint()
 
+BATCH_API_VERSION = "2025-10-15"
+FAST_API_VERSION = "2024-11-15"
+TICKS_PER_MILLISECOND = 10000
+# Fast transcription diarizes at most two channels
+FAST_MAX_CHANNELS = 2
+# Enough to cover the RIFF, fmt and metadata chunks that precede the audio data in a WAV file
+WAV_HEADER_BYTES = 64 * 1024
+
+
+def get_headers(config, content_type='application/json'):
+    token = config.credential.get_token("https://cognitiveservices.azure.com/.default").token
+    headers = {"Authorization": f"Bearer {token}"}
+    if content_type:
+        headers['Content-Type'] = content_type
+    return headers
+
+
+def get_transcription_status(config, transcription_url):
+    """
+    Fetch a batch transcription job's status with a fresh token.
+
+    Raises:
+        PermanentError: If the job failed; failed jobs are caused by the input (unreadable audio,
+            inaccessible URL), not by load.
+    """
+    status_response = requests.get(transcription_url, headers=get_headers(config))
+    status_response.raise_for_status()
+    status = status_response.json()
+
+    current_status = status['status']
+    logging.info(f"Transcription status: {current_status}")
+    if current_status == 'Failed':
+        error = status.get('properties', {}).get('error', 'Unknown error')
+        raise PermanentError(f"Transcription failed: {error}")
+    return status
+
 
-def wait_for_transcription(transcription_url, headers, check_interval=10):
+def wait_for_transcription(config, transcription_url, check_interval=10):
     """Poll the transcription status until it's complete"""
     while True:
-        status_response = requests.get(transcription_url, headers=headers)
-        status = status_response.json()
-        
-        current_status = status['status']
-        print(f"Status: {current_status}")
-        
-        if current_status == 'Succeeded':
-            print("Transcription completed successfully!")
+        status = get_transcription_status(config, transcription_url)
+        if status['status'] == 'Succeeded':
             return status
-        elif current_status == 'Failed':
-            print("Transcription failed!")
-            print(f"Error: {status.get('properties', {}).get('error', 'Unknown error')}")
-            return status
-        else:
-            print(f"Waiting {check_interval} seconds before checking again...")
-            time.sleep(check_interval)
+        time.sleep(check_interval)
 
 
-@bp.function_name(name)
-@bp.activity_trigger(input_name="blob_input")
-def run(blob_input: dict):
+def phrases_to_text(phrases):
+    """Join (offset_ms, channel, text) phrases in timestamp order across all channels."""
+    return "\n".join(text for _, _, text in sorted(phrases, key=lambda phrase: (phrase[0], phrase[1])))
+
+
+def submit_batch_transcription(config, content_urls, locales):
+    """Submit one batch transcription job for all content URLs and return the job's status URL."""
+    endpoint = config.get_value("AI_SERVICES_ENDPOINT").rstrip('/')
+    url = f"{endpoint}/speechtotext/transcriptions:submit?api-version={BATCH_API_VERSION}"
+    headers = get_headers(config)
+
+    properties = {
+        "wordLevelTimestampsEnabled": False,
+        "displayFormWordLevelTimestampsEnabled": False,
+        "punctuationMode": "DictatedAndAutomatic",
+        "profanityFilterMode": "Masked",
+        "timeToLiveHours": 48
+    }
+    if len(locales) > 1:
+        properties["languageIdentification"] = {"candidateLocales": locales}
+
+    payload = {
+        "displayName": "Transcription",
+        "locale": locales[0],
+        "contentUrls": content_urls,
+        "properties": properties
+    }
+
+    logging.info(f"Submitting batch transcription for {len(content_urls)} file(s) with payload: {payload}")
+    response = requests.post(url, json=payload, headers=headers)
+    response.raise_for_status()
+    return response.json()['self']
+
+
+def collect_batch_results(config, files_url):
+    """Return a mapping of source URL to transcript for every transcription file of a finished job."""
+    results = {}
+    while files_url:
+        files_response = requests.get(files_url, headers=get_headers(config))
+        files_response.raise_for_status()
+        files = files_response.json()
+        for file in files.get('values', []):
+            if file.get('kind') != 'Transcription':
+                continue
+            content = requests.get(file['links']['contentUrl']).json()
+            phrases = [
+                (
+                    phrase.get('offsetInTicks', 0) / TICKS_PER_MILLISECOND,
+                    phrase.get('channel', 0),
+                    phrase['nBest'][0]['display']
+                )
+                for phrase in content.get('recognizedPhrases', [])
+                if phrase.get('nBest')
+            ]
+            results[content.get('source')] = phrases_to_text(phrases)
+        files_url = files.get('@nextLink')
+    return results
+
+
+def split_wav(content, segment_seconds):
+    """Split a WAV file into (offset_ms, wav_bytes) segments of at most `segment_seconds`."""
+    segments = []
+    with wave.open(io.BytesIO(content), 'rb') as source:
+        params = source.getparams()
+        frames_per_segment = int(params.framerate * segment_seconds)
+        offset_frames = 0
+        while offset_frames < params.nframes:
+            frames = source.readframes(frames_per_segment)
+            buffer = io.BytesIO()
+            with wave.open(buffer, 'wb') as segment:
+                segment.setparams(params)
+                segment.writeframes(frames)
+            segments.append((offset_frames * 1000 // params.framerate, buffer.getvalue()))
+            offset_frames += frames_per_segment
+    return segments
+
+
+def wav_info(content):
+    """
+    Return (duration_seconds, channels) of a WAV file, or None if the `wave` module cannot read it.
+
+    Only the header is read, so `content` may be just the first WAV_HEADER_BYTES of the file.
+    `wave` only reads PCM; IEEE-float and WAVE_FORMAT_EXTENSIBLE files raise `wave.Error`. The
+    Speech service accepts them, so callers send those to batch transcription unsegmented.
+    """
+    try:
+        with wave.open(io.BytesIO(content), 'rb') as source:
+            return source.getnframes() / source.getframerate(), source.getnchannels()
+    except (wave.Error, EOFError) as e:
+        logging.info(f"Cannot read WAV header locally, skipping segmentation: {e}")
+        return None
+
+
+def transcribe_segment(config, audio_bytes, locales, channels, offset_ms, filename="segment.wav"):
+    """Transcribe one segment with the fast transcription API; returns phrases shifted by the segment offset."""
+    endpoint = config.get_value("AI_SERVICES_ENDPOINT").rstrip('/')
+    url = f"{endpoint}/speechtotext/transcriptions:transcribe?api-version={FAST_API_VERSION}"
+    definition = {"locales": locales}
+    if channels > 1:
+        definition["channels"] = list(range(min(channels, FAST_MAX_CHANNELS)))
+
+    response = requests.post(
+        url,
+        headers=get_headers(config, content_type=None),
+        files={
+            "audio": (filename, audio_bytes),
+            "definition": (None, json.dumps(definition), "application/json")
+        }
+    )
+    response.raise_for_status()
+    return [
+        (offset_ms + phrase.get('offsetMilliseconds', 0), phrase.get('channel', 0), phrase['text'])
+        for phrase in response.json().get('phrases', [])
+    ]
+
+
+def transcribe_segmented(config, content, locales):
+    """Split a long WAV recording into segments, transcribe them concurrently and stitch the phrases."""
+    segment_seconds = SPEECH_SEGMENT_SECONDS
+    max_workers = SPEECH_MAX_CONCURRENT_SEGMENTS
+    _, channels = wav_info(content)
+    segments = split_wav(content, segment_seconds)
+    logging.info(f"Transcribing {len(segments)} segment(s) of {segment_seconds}s with {max_workers} workers")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda segment: transcribe_segment(config, segment[1], locales, channels, segment[0]),
+            segments
+        )
+        phrases = [phrase for segment_phrases in results for phrase in segment_phrases]
+
+    return phrases_to_text(phrases)
+
+
+def transcribe_content(blob_name: str, content: bytes):
+    """
+    Transcribes audio bytes that are not reachable by URL (e.g. local files in the batch runner).
+
+    Long WAV recordings are segmented as in `transcribe`; anything else is sent to the fast
+    transcription API in a single request. Without a URL there is no batch fallback, so only the
+    first two channels of a multi-channel recording are transcribed.
+    """
+    channels = 1
+    info = wav_info(content) if blob_name.lower().endswith('.wav') else None
+    if info:
+        duration, channels = info
+        if duration > SPEECH_SEGMENT_THRESHOLD_SECONDS:
+            return transcribe_segmented(config, content, SPEECH_LOCALES)
+
+    return phrases_to_text(transcribe_segment(config, content, SPEECH_LOCALES, channels, 0, filename=os.path.basename(blob_name)))
+
+
+def transcribe(blob_input: dict):
+    """
+    Transcribes one audio blob.
+
+    Long PCM WAV recordings (over SPEECH_SEGMENT_THRESHOLD_SECONDS, at most two channels) are
+    split and transcribed concurrently with the fast transcription API; everything else is
+    submitted as a batch job.
+    """
     # Parse Arguments
-    try: 
+    try:
         blob_name = blob_input.get('name')
         container = blob_input.get('container')
         blob_uri = blob_input.get('uri')
 
+        if blob_name.lower().endswith('.wav'):
+            blob_path = normalize_blob_name(container, blob_name)
+            # Read the header only; the whole recording is downloaded only when it is segmented
+            info = wav_info(get_blob_range(container, blob_path, 0, WAV_HEADER_BYTES))
+            # Recordings with more channels than fast transcription supports keep every channel in a batch job
+            if info and info[0] > SPEECH_SEGMENT_THRESHOLD_SECONDS and info[1] <= FAST_MAX_CHANNELS:
+                logging.info(f"Using segmented transcription for {blob_name} ({info[0]:.0f}s)")
+                content = get_blob_content(container_name=container, blob_path=blob_path)
+                return transcribe_segmented(config, content, SPEECH_LOCALES)
 
-        config = Configuration()
-        credential = config.credential
-        token = credential.get_token("https://cognitiveservices.azure.com/.default").token
-        
-        endpoint = config.get_value("AI_SERVICES_ENDPOINT")
-        api_version = "2025-10-15"
-        url = f"{endpoint}/speechtotext/transcriptions:submit?api-version={api_version}"
+        logging.info(f"Submitting transcription request for blob: {blob_name} in container: {container}")
+        transcription_url = submit_batch_transcription(config, [blob_uri], SPEECH_LOCALES)
+        final_status = wait_for_transcription(config, transcription_url)
+        results = collect_batch_results(config, final_status['links']['files'])
+        full_text = results.get(blob_uri) or next(iter(results.values()), "")
 
-        headers = {
-            'Content-Type': 'application/json',
-            "Authorization": f"Bearer {token}",
-        }
+    except Exception as e:
+        logging.error(f"Error during speech-to-text processing: {e}")
+        raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
 
-        payload = {
-            "displayName": "Transcription",
-            "locale": "en-US",
-            "contentUrls": [blob_uri], #
-            "properties": {
-                "wordLevelTimestampsEnabled": False,
-                "displayFormWordLevelTimestampsEnabled": False,
-                "punctuationMode": "DictatedAndAutomatic",
-                "profanityFilterMode": "Masked",
-                "timeToLiveHours": 48
-            }
-        }
+    return full_text
 
-        logging.info(f"Submitting transcription request for blob: {blob_name} in container: {container} with payload: {payload}")
-        response = requests.post(url, json=payload, headers=headers)
-        transcription_url = response.json()['self']
 
-        # Wait for completion
-        final_status = wait_for_transcription(transcription_url, headers)
+@bp.function_name(batch_submit_name)
+@bp.activity_trigger(input_name="batch_input")
+def run_batch_submit(batch_input: dict):
+    """
+    Submits one batch transcription job for many audio blobs.
 
-        files_url = final_status['links']['files']
+    The job is polled by the orchestrator (see `speechToTextBatchStatus`) so that a long job does
+    not hold an activity, or a single access token, for its whole duration.
 
-        files_response = requests.get(files_url, headers=headers)
-        content_url = files_response.json()['values'][0]['links']['contentUrl']
-        content_response = requests.get(content_url).json()
-        # content_response.json()
-        full_text = content_response['combinedRecognizedPhrases'][0]['display']
+    Args:
+        batch_input (dict): {"blobs": [blob_input, ...]} where each blob_input has name, container and uri.
+
+    Returns:
+        dict: {"transcription_url": ...} to pass to the status activity.
+    """
+    try:
+        content_urls = [blob['uri'] for blob in batch_input.get('blobs', [])]
+        return {"transcription_url": submit_batch_transcription(config, content_urls, SPEECH_LOCALES)}
 
     except Exception as e:
-        logging.error(f"Error during speech-to-text processing: {e}")
-        raise  # Re-raise to allow Durable Functions to retry
+        logging.error(f"Error submitting batch transcription: {e}")
+        raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
 
-    return full_text
+
+@bp.function_name(batch_status_name)
+@bp.activity_trigger(input_name="job")
+def run_batch_status(job: dict):
+    """
+    Checks a batch transcription job once.
+
+    Args:
+        job (dict): {"transcription_url": ...} as returned by the submit activity.
+
+    Returns:
+        dict: {"status": ..., "files_url": ...}; files_url is set once the job has succeeded.
+    """
+    try:
+        status = get_transcription_status(config, job['transcription_url'])
+        return {"status": status['status'], "files_url": status.get('links', {}).get('files')}
+
+    except Exception as e:
+        logging.error(f"Error checking batch transcription status: {e}")
+        raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
+
+
+@bp.function_name(batch_collect_name)
+@bp.activity_trigger(input_name="collect_input")
+def run_batch_collect(collect_input: dict):
+    """
+    Downloads the transcripts of a finished batch transcription job.
+
+    Args:
+        collect_input (dict): {"files_url": ..., "blobs": [blob_input, ...]}
+
+    Returns:
+        list: The transcript for each blob, in the same order as the input; "" when the job
+            returned none for a file.
+    """
+    try:
+        results = collect_batch_results(config, collect_input['files_url'])
+
+        content_urls = [blob['uri'] for blob in collect_input.get('blobs', [])]
+        missing = [url for url in content_urls if url not in results]
+        if missing:
+            logging.warning(f"No transcript returned for {len(missing)} file(s): {missing}")
+        return [results.get(url, "") for url in content_urls]
+
+    except Exception as e:
+        logging.error(f"Error collecting batch transcription results: {e}")
+        raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
+
+
+@bp.function_name(name)
+@bp.activity_trigger(input_name="blob_input")
+def run(blob_input: dict):
+    return transcribe(blob_input)
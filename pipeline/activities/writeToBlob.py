@@ -1,7 +1,8 @@
 import azure.durable_functions as df
 import logging
-from pipelineUtils.blob_functions import list_blobs, get_blob_content, write_to_blob
-import os
+from pipelineUtils.blob_functions import list_blobs, get_blob_content, write_to_blob, get_output_blob_name
+from pipelineUtils.errors import to_pipeline_error
+from urllib.parse import quote
 
 from configuration import Configuration
 config = Configuration()
@@ -13,13 +14,13 @@ logging.info(f"writeToBlob.py: FINAL_OUTPUT_CONTAINER is {FINAL_OUTPUT_CONTAINER
 name = "writeToBlob"
 bp = df.Blueprint()
 
-@bp.function_name(name)
-@bp.activity_trigger(input_name="args")
-def write_to_blob_activity(args: dict):
+def write_output(args: dict):
   """
   Writes the JSON bytes to a blob storage.
   Args:
-      args (dict): A dictionary containing the blob name and JSON bytes.
+      args (dict): A dictionary containing the blob name, source container, JSON string and
+          the prompt version and partial flag returned by callAoai. These are stored as blob
+          metadata so the gold compaction stage can partition the output and flag partial results.
   """
   try:
         # Parse arguments
@@ -29,16 +30,26 @@ def write_to_blob_activity(args: dict):
       
       args['json_bytes'] = json_str.encode('utf-8')
 
-      sourcefile = os.path.splitext(os.path.basename(blob_name))[0]
-      logging.info(f"writeToBlob.py: Writing output to blob {sourcefile}-output.json with source file {sourcefile} and FINAL_OUTPUT_CONTAINER {final_output_container}")
-      result = write_to_blob(final_output_container, f"{sourcefile}-output.json", args['json_bytes'])
+      # Orchestrations started before callAoai returned the prompt version have none
+      prompt_version = args.get('prompt_version') or "unknown"
+      metadata = {
+          # Blob metadata must be ASCII
+          "source_blob": quote(blob_name),
+          "prompt_version": prompt_version,
+          # Output cut off at the model's token limit is valid JSON but may be missing entries
+          "partial": "true" if args.get('partial') else "false"
+      }
+
+      output_blob = get_output_blob_name(blob_name, args.get('container'))
+      logging.info(f"writeToBlob.py: Writing output to blob {output_blob} and FINAL_OUTPUT_CONTAINER {final_output_container}")
+      result = write_to_blob(final_output_container, output_blob, args['json_bytes'], metadata=metadata)
       logging.info(f"writeToBlob.py: Result of write_to_blob: {result}")
       if result:
           logging.info(f"writeToBlob.py: Successfully wrote output to blob {blob_name}")
           return {
               "success": True,
               "blob_name": blob_name,
-              "output_blob": f"{sourcefile}-output.json"
+              "output_blob": output_blob
           }
       else:
           logging.error(f"Failed to write output to blob {blob_name}")
@@ -49,4 +60,10 @@ def write_to_blob_activity(args: dict):
   except Exception as e:
       error_msg = f"Error writing output for blob {blob_name}: {str(e)}"
       logging.error(error_msg)
-      raise  # Re-raise to allow Durable Functions to retry
+      raise to_pipeline_error(e) from e  # Tag with a retry category for the orchestrator
+
+
+@bp.function_name(name)
+@bp.activity_trigger(input_name="args")
+def write_to_blob_activity(args: dict):
+  return write_output(args)
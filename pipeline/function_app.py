@@ -1,20 +1,30 @@
 import os
+import json
 import logging
+from datetime import timedelta
 
 import azure.functions as func
 import azure.durable_functions as df
-from azure.durable_functions import RetryOptions
 
 
-from activities import runDocIntel, callAiFoundry, writeToBlob, speechToText, callFoundryMultiModal
+from activities import runDocIntel, callAiFoundry, writeToBlob, speechToText, callFoundryMultiModal, quarantineBlob
 from configuration import Configuration
 
 from pipelineUtils.blob_functions import BlobMetadata
+from pipelineUtils.backfill import BackfillOptions, BackfillInProgressError, BackfillOptionsMismatchError, run_backfill
+from pipelineUtils.compaction import compact_outputs
+from pipelineUtils.task_hub_maintenance import purge_task_hub_history
+from pipelineUtils.options import PipelineOptions
+from pipelineUtils.routing import AUDIO_EXTENSIONS, DOCUMENT_EXTENSIONS, MULTIMODAL_EXTENSIONS, get_file_extension
+from pipelineUtils.errors import PERMANENT, ActivityFailedError, call_activity_classified
 
 config = Configuration()
 
 # NEXT_STAGE = config.get_value("NEXT_STAGE")
-FINAL_OUTPUT_CONTAINER = config.get_value("FINAL_OUTPUT_CONTAINER")
+
+# Fallback for orchestrations started before options were snapshotted into the input.
+# Resolved once per worker, never during replay.
+DEFAULT_PIPELINE_OPTIONS = PipelineOptions.from_config(config)
 
 app = df.DFApp(http_auth_level=func.AuthLevel.FUNCTION)
 
@@ -36,7 +46,11 @@ async def _handle_blob_trigger(
     )
     logging.info(f"Blob Metadata: {blob_metadata}")
     logging.info(f"Blob Metadata JSON: {blob_metadata.to_dict()}")
-    instance_id = await client.start_new("process_blob", client_input=blob_metadata.to_dict())
+    orchestration_input = {
+        **blob_metadata.to_dict(),
+        "options": PipelineOptions.from_config(config).to_dict()
+    }
+    instance_id = await client.start_new("process_blob", client_input=orchestration_input)
     logging.info(f"Started orchestration {instance_id} for blob {blob.name}")
 
 
@@ -100,7 +114,8 @@ async def start_orchestrator_http(req: func.HttpRequest, client):
     blob_input = {
         "name": blob_name,
         "container": "bronze",
-        "uri": blob_uri
+        "uri": blob_uri,
+        "options": PipelineOptions.from_config(config).to_dict()
     }
 
     #invoke the process_blob function with the list of blobs
@@ -111,91 +126,307 @@ async def start_orchestrator_http(req: func.HttpRequest, client):
     return response
 
 
+# HTTP-triggered backfill: reprocess blobs that already exist in a container
+@app.route(route="backfill", methods=["POST"])
+@app.durable_client_input(client_name="client")
+async def start_backfill_http(req: func.HttpRequest, client):
+    """
+    Starts or resumes a throttled backfill over an existing container.
+
+    args:
+        req (func.HttpRequest): JSON body with job_id and optional container, prefix, modified_after,
+            modified_before, extensions, skip_existing, rate_per_second, page_size and max_runtime_seconds.
+            Calling again with the same job_id resumes from the persisted checkpoint.
+        client (DurableOrchestrationClient): The Durable Functions client.
+    response:
+        func.HttpResponse: The checkpoint as JSON. 202 while the job has more blobs to scan, 200 once complete,
+            409 if the same job_id is already running or was started with different scan options.
+    """
+    try:
+        options = BackfillOptions.from_dict(req.get_json())
+    except ValueError as e:
+        return func.HttpResponse(f"Invalid backfill request: {e}", status_code=400)
+
+    try:
+        checkpoint = await run_backfill(client, options, PipelineOptions.from_config(config))
+    except (BackfillInProgressError, BackfillOptionsMismatchError) as e:
+        return func.HttpResponse(str(e), status_code=409)
+    return func.HttpResponse(
+        json.dumps(checkpoint.to_dict()),
+        status_code=200 if checkpoint.completed else 202,
+        mimetype="application/json"
+    )
+
+
+# HTTP-triggered audio batch: transcribe many audio blobs with a single batch transcription job
+@app.route(route="audio_batch", methods=["POST"])
+@app.durable_client_input(client_name="client")
+async def start_audio_batch_http(req: func.HttpRequest, client):
+    """
+    Starts a process_audio_batch orchestration for a list of audio blobs.
+
+    args:
+        req (func.HttpRequest): JSON body {"blobs": [{"name": ..., "uri": ...}, ...]}
+        client (DurableOrchestrationClient): The Durable Functions client.
+    response:
+        func.HttpResponse: The HTTP response object.
+    """
+    try:
+        blobs = req.get_json().get("blobs")
+    except ValueError:
+        return func.HttpResponse("Invalid JSON.", status_code=400)
+
+    if not blobs:
+        return func.HttpResponse("Request body must contain a non-empty 'blobs' list.", status_code=400)
+
+    batch_input = {
+        "blobs": [
+            {"name": blob.get("name"), "container": blob.get("container", "bronze"), "uri": blob.get("uri")}
+            for blob in blobs
+        ],
+        "options": PipelineOptions.from_config(config).to_dict()
+    }
+    instance_id = await client.start_new('process_audio_batch', client_input=batch_input)
+    logging.info(f"Started audio batch orchestration {instance_id} for {len(blobs)} blobs.")
+
+    return client.create_check_status_response(req, instance_id)
+
+
+# Gold-layer compaction of per-document outputs (hourly)
+@app.function_name(name="compact_outputs_timer")
+@app.timer_trigger(arg_name="timer", schedule="0 0 * * * *", run_on_startup=False)
+def compact_outputs_timer(timer: func.TimerRequest):
+    if timer.past_due:
+        logging.info("Compaction timer is past due")
+    summary = compact_outputs()
+    logging.info(f"Compaction summary: {summary}")
+
+
+# Task hub maintenance: index and purge finished orchestration history (hourly)
+@app.function_name(name="maintain_task_hub_timer")
+@app.timer_trigger(arg_name="timer", schedule="0 30 * * * *", run_on_startup=False)
+@app.durable_client_input(client_name="client")
+async def maintain_task_hub_timer(timer: func.TimerRequest, client):
+    if timer.past_due:
+        logging.info("Task hub maintenance timer is past due")
+    summary = await purge_task_hub_history(client)
+    logging.info(f"Task hub maintenance summary: {summary}")
+
+
+def _elapsed_seconds(context, started):
+    return (context.current_utc_datetime - started).total_seconds()
+
+
+def _aoai_result(aoai_output):
+    """Return (json_str, prompt_version, partial) from a callAoai result; histories recorded before the prompt version was returned hold a bare string."""
+    if isinstance(aoai_output, dict):
+        return aoai_output["json_str"], aoai_output.get("prompt_version"), aoai_output.get("partial", False)
+    return aoai_output, None, False
+
+
 #Sub orchestrator
 @app.function_name(name="process_blob")
 @app.orchestration_trigger(context_name="context")
 def process_blob(context):
     blob_input = context.get_input()
     sub_orchestration_id = context.instance_id 
-    logging.info(f"Process Blob sub Orchestration - Processing blob_metadata: {blob_input} with sub orchestration id: {sub_orchestration_id}")
+    options = PipelineOptions.from_dict(blob_input["options"]) if "options" in blob_input else DEFAULT_PIPELINE_OPTIONS
+    if not context.is_replaying:
+        logging.info(f"Process Blob sub Orchestration - Processing blob {blob_input.get('name')} with sub orchestration id: {sub_orchestration_id}")
     # Get file extensions
     blob_name = blob_input.get("name", "")
-    file_extension = blob_name.lower().split('.')[-1] if '.' in blob_name else ""
-    # Audio file extensions
-    audio_extensions = ['wav', 'mp3', 'opus', 'ogg', 'flac', 'wma', 'aac', 'webm']
-    # Document file extensions
-    document_extensions = ['pdf', 'docx', 'doc', 'xlsx', 'pptx', 'jpg', 'jpeg', 'png', 'tiff', 'bmp']
-    
+    file_extension = get_file_extension(blob_name)
 
-    # Define retry options for handling transient failures
-    # Note: backoff_coefficient requires azure-functions-durable >= 1.3.0
-    retry_options = RetryOptions(
-        first_retry_interval_in_milliseconds=5000,    # 5 seconds initial wait
-        max_number_of_attempts=5                       # More attempts for rate limit scenarios
-    )
+    # Stage durations in seconds, measured with the replay-safe orchestration clock
+    stage_timings = {}
 
-    # 1. Process Data Source based on file type
-    if config.get_value("AOAI_MULTI_MODAL", "false").lower() == "true" and file_extension in document_extensions:
-        aoai_input = {
-            "name": blob_input.get("name"),
-            "container": blob_input.get("container"),
-            "uri": blob_input.get("uri"),
-            "instance_id": sub_orchestration_id
-        }
-
-        text_result = yield context.call_activity_with_retry("callAoaiMultiModal", retry_options, aoai_input)
-
-
-    elif config.get_value("AI_VISION_ENABLED", "false").lower() == "true":
-        pass
+    # Activities tag failures as transient, throttled, permanent or fatal; only the first two are retried
+    # (with backoff). Permanent failures (caused by the document) move the blob to quarantine; fatal
+    # failures (credentials, settings, prompts) fail the orchestration and leave the blob in place
+    # Transcripts from process_audio_batch arrive with the input; removed so results do not echo them
+    upstream_text = blob_input.pop("text_result", None)
 
-    elif file_extension in audio_extensions:
-        # Process audio with speech-to-text
-        logging.info(f"Processing audio file: {blob_name}")
-        text_result = yield context.call_activity_with_retry("speechToText", retry_options, blob_input)
+    try:
+        # 1. Process Data Source based on file type
+        if upstream_text is not None:
+            text_result = upstream_text
+
+        elif options.multi_modal and file_extension in MULTIMODAL_EXTENSIONS:
+            aoai_input = {
+                "name": blob_input.get("name"),
+                "container": blob_input.get("container"),
+                "uri": blob_input.get("uri"),
+                "instance_id": sub_orchestration_id
+            }
+
+            stage_started = context.current_utc_datetime
+            text_result = yield from call_activity_classified(context, "callAoaiMultiModal", aoai_input)
+            stage_timings["extract"] = _elapsed_seconds(context, stage_started)
+
+
+        elif options.vision_enabled:
+            pass
+
+        elif file_extension in AUDIO_EXTENSIONS:
+            # Process audio with speech-to-text
+            if not context.is_replaying:
+                logging.info(f"Processing audio file: {blob_name}")
+            stage_started = context.current_utc_datetime
+            text_result = yield from call_activity_classified(context, "speechToText", blob_input)
+            stage_timings["extract"] = _elapsed_seconds(context, stage_started)
+
+        elif file_extension in DOCUMENT_EXTENSIONS:
+            # Process document with Document Intelligence
+            if not context.is_replaying:
+                logging.info(f"Processing document file: {blob_name}")
+            stage_started = context.current_utc_datetime
+            text_result = yield from call_activity_classified(context, "runDocIntel", blob_input)
+            stage_timings["extract"] = _elapsed_seconds(context, stage_started)
+            
+        else:
+            # Unsupported file type
+            if not context.is_replaying:
+                logging.warning(f"Unsupported file type: {file_extension} for blob: {blob_name}")
+            return {
+                "blob": blob_input,
+                "error": f"Unsupported file type: {file_extension}",
+                "status": "skipped"
+            }
+        
+        # 2. Feed Output into AOAI to get insights
+        # Package the data into a dictionary
+        call_aoai_input = {
+            "text_result": text_result,
+            "instance_id": sub_orchestration_id 
+        }
 
-    elif file_extension in document_extensions:
-        # Process document with Document Intelligence
-        logging.info(f"Processing document file: {blob_name}")
-        text_result = yield context.call_activity_with_retry("runDocIntel", retry_options, blob_input)
+        stage_started = context.current_utc_datetime
+        aoai_output = yield from call_activity_classified(context, "callAoai", call_aoai_input)
+        json_str, prompt_version, partial = _aoai_result(aoai_output)
+        stage_timings["aoai"] = _elapsed_seconds(context, stage_started)
         
-    else:
-        # Unsupported file type
-        logging.warning(f"Unsupported file type: {file_extension} for blob: {blob_name}")
+
+        # 3. Write AOAI output to Blob Storage
+        stage_started = context.current_utc_datetime
+        task_result = yield from call_activity_classified(
+            context,
+            "writeToBlob", 
+            {
+                "json_str": json_str, 
+                "prompt_version": prompt_version,
+                "partial": partial,
+                "blob_name": blob_input["name"],
+                "container": blob_input.get("container"),
+                "final_output_container": options.final_output_container
+            }
+        )
+        stage_timings["write"] = _elapsed_seconds(context, stage_started)
+
+    except ActivityFailedError as e:
+        if e.category != PERMANENT:
+            raise  # Fatal or retries exhausted: fail the orchestration so the blob can be reprocessed later
+        if not context.is_replaying:
+            logging.warning(f"Quarantining blob {blob_name}: {e}")
+        error = {"activity": e.activity_name, "category": e.category, "message": e.message}
+        quarantine_result = yield from call_activity_classified(context, "quarantineBlob", {
+            "blob": blob_input,
+            "instance_id": sub_orchestration_id,
+            "error": error
+        })
         return {
             "blob": blob_input,
-            "error": f"Unsupported file type: {file_extension}",
-            "status": "skipped"
+            "error": error,
+            "status": "quarantined",
+            "quarantine_result": quarantine_result,
+            "stage_timings": stage_timings
         }
-    
-    # 2. Feed Output into AOAI to get insights
-    # Package the data into a dictionary
-    call_aoai_input = {
-        "text_result": text_result,
-        "instance_id": sub_orchestration_id 
-    }
-
-    aoai_output = yield context.call_activity_with_retry("callAoai", retry_options, call_aoai_input)
-    
 
-    # 3. Write AOAI output to Blob Storage
-    task_result = yield context.call_activity_with_retry(
-        "writeToBlob", 
-        retry_options,
-        {
-            "json_str": aoai_output, 
-            "blob_name": blob_input["name"],
-            "final_output_container": FINAL_OUTPUT_CONTAINER
-        }
-    )
     return {
         "blob": blob_input,
-        "text_result": aoai_output,
-        "task_result": task_result
+        "text_result": json_str,
+        "task_result": task_result,
+        "stage_timings": stage_timings
     }   
 
+# Maximum number of content URLs accepted by a single batch transcription job
+AUDIO_BATCH_MAX_FILES = 1000
+
+# Batch transcription polling: the interval doubles from the first to the last value; jobs expire after 48 hours
+AUDIO_BATCH_FIRST_POLL_SECONDS = 30
+AUDIO_BATCH_MAX_POLL_SECONDS = 300
+AUDIO_BATCH_MAX_WAIT = timedelta(hours=48)
+
+
+@app.function_name(name="transcribe_audio_batch")
+@app.orchestration_trigger(context_name="context")
+def transcribe_audio_batch(context):
+    """
+    Runs one batch transcription job: submit, poll with durable timers until it finishes, collect.
+
+    Each step is a short activity with its own token, so the job may run for hours without
+    holding an activity open. Returns the transcript for each input blob, in order.
+    """
+    blobs = context.get_input()["blobs"]
+    job = yield from call_activity_classified(context, "speechToTextBatchSubmit", {"blobs": blobs})
+
+    deadline = context.current_utc_datetime + AUDIO_BATCH_MAX_WAIT
+    poll_seconds = AUDIO_BATCH_FIRST_POLL_SECONDS
+    while True:
+        status = yield from call_activity_classified(context, "speechToTextBatchStatus", job)
+        if status["status"] == "Succeeded":
+            break
+        if context.current_utc_datetime >= deadline:
+            raise TimeoutError(f"Batch transcription {job['transcription_url']} did not finish within {AUDIO_BATCH_MAX_WAIT}")
+        yield context.create_timer(context.current_utc_datetime + timedelta(seconds=poll_seconds))
+        poll_seconds = min(poll_seconds * 2, AUDIO_BATCH_MAX_POLL_SECONDS)
+
+    transcripts = yield from call_activity_classified(context, "speechToTextBatchCollect", {
+        "files_url": status["files_url"],
+        "blobs": blobs
+    })
+    return transcripts
+
+
+@app.function_name(name="process_audio_batch")
+@app.orchestration_trigger(context_name="context")
+def process_audio_batch(context):
+    batch_input = context.get_input()
+    blobs = batch_input["blobs"]
+    options = PipelineOptions.from_dict(batch_input["options"]) if "options" in batch_input else DEFAULT_PIPELINE_OPTIONS
+
+    # 1. Transcribe every blob with as few batch transcription jobs as possible
+    chunks = [blobs[i:i + AUDIO_BATCH_MAX_FILES] for i in range(0, len(blobs), AUDIO_BATCH_MAX_FILES)]
+    chunk_results = yield context.task_all([
+        context.call_sub_orchestrator("transcribe_audio_batch", {"blobs": chunk})
+        for chunk in chunks
+    ])
+    transcripts = [text for chunk_result in chunk_results for text in chunk_result]
+
+    # 2. Run each transcript through process_blob (callAoai and writeToBlob with classified retries and
+    # quarantine); files with no transcript (silence, or missing from the job's results) are skipped
+    skipped = []
+    transcript_inputs = []
+    for blob_input, text_result in zip(blobs, transcripts):
+        if not text_result or not text_result.strip():
+            skipped.append({"blob": blob_input, "error": "No transcript returned", "status": "skipped"})
+        else:
+            transcript_inputs.append({**blob_input, "options": options.to_dict(), "text_result": text_result})
+
+    if skipped and not context.is_replaying:
+        logging.warning(f"Audio batch {context.instance_id}: skipping {len(skipped)} file(s) with no transcript: {[item['blob']['name'] for item in skipped]}")
+
+    results = []
+    if transcript_inputs:
+        results = yield context.task_all([
+            context.call_sub_orchestrator("process_blob", transcript_input)
+            for transcript_input in transcript_inputs
+        ])
+
+    return results + skipped
+
 app.register_functions(runDocIntel.bp)
 app.register_functions(callAiFoundry.bp)
 app.register_functions(writeToBlob.bp)
 app.register_functions(speechToText.bp)
-app.register_functions(callFoundryMultiModal.bp)
\ No newline at end of file
+app.register_functions(callFoundryMultiModal.bp)
+app.register_functions(quarantineBlob.bp)
\ No newline at end of file
@@ -1,5 +1,248 @@
-def main():
-    print("Hello from pipeline!")
+"""
+Standalone batch runner for the pipeline.
+
+Runs the same stage functions as the Durable orchestration (text extraction or transcription,
+callAoai, writeToBlob) directly in a process pool, without the Functions host or task hub.
+Useful for large one-off jobs on a single VM/container and for profiling stages in isolation.
+
+Examples:
+    python main.py --input-dir ./docs --output-dir ./out
+    python main.py --container bronze --prefix invoices/2024/ --workers 16 --max-in-flight 64
+    python main.py --input-dir ./docs --stop-after extract --manifest extract-profile.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, ALL_COMPLETED, wait
+from datetime import datetime, timezone
+
+from tqdm import tqdm
+
+from pipelineUtils.routing import AUDIO_EXTENSIONS, DOCUMENT_EXTENSIONS, get_file_extension
+from pipelineUtils.errors import classify_exception
+
+STAGES = ["extract", "aoai", "write"]
+
+
+def discover_local(input_dir, extensions):
+    """Yield work items for every file under input_dir."""
+    for root, _, files in os.walk(input_dir):
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            name = os.path.relpath(path, input_dir).replace(os.sep, "/")
+            if extensions and get_file_extension(name) not in extensions:
+                continue
+            yield {"source": "local", "name": name, "path": path}
+
+
+def discover_container(container, prefix, extensions):
+    """Yield work items for every blob in the container, one listing page at a time."""
+    from pipelineUtils.blob_functions import list_blobs_page, get_blob_uri
+
+    continuation_token = None
+    while True:
+        blobs, continuation_token = list_blobs_page(container, name_starts_with=prefix, continuation_token=continuation_token)
+        for blob in blobs:
+            if extensions and get_file_extension(blob.name) not in extensions:
+                continue
+            yield {
+                "source": "blob",
+                "name": blob.name,
+                "container": container,
+                "uri": get_blob_uri(container, blob.name)
+            }
+        if continuation_token is None:
+            return
+
+
+def extract(item):
+    """Run the extraction stage for one item, from local bytes or from the blob."""
+    from activities import runDocIntel, speechToText
+
+    extension = get_file_extension(item["name"])
+    if item["source"] == "local":
+        with open(item["path"], "rb") as file:
+            content = file.read()
+        if extension in AUDIO_EXTENSIONS:
+            return speechToText.transcribe_content(item["name"], content)
+        return runDocIntel.extract_text(item["name"], content)
+
+    blob_input = {"name": item["name"], "container": item["container"], "uri": item["uri"]}
+    if extension in AUDIO_EXTENSIONS:
+        return speechToText.transcribe(blob_input)
+    return runDocIntel.extract_blob_text(blob_input)
+
+
+def write(item, aoai_output, output_dir, final_output_container):
+    """Write the output next to the other local outputs, or to the output container like writeToBlob."""
+    from activities import writeToBlob
+    from pipelineUtils.blob_functions import get_output_blob_name
+
+    if output_dir:
+        output_path = os.path.join(output_dir, get_output_blob_name(item["name"]))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as file:
+            file.write(aoai_output["json_str"])
+        return output_path
+
+    result = writeToBlob.write_output({
+        "json_str": aoai_output["json_str"],
+        "prompt_version": aoai_output["prompt_version"],
+        "partial": aoai_output["partial"],
+        "blob_name": item["name"],
+        "container": item.get("container"),
+        "final_output_container": final_output_container
+    })
+    return result.get("output_blob")
+
+
+def process_item(item, run_id, stop_after, output_dir, final_output_container):
+    """
+    Run the pipeline stages for one item in a worker process.
+
+    Returns a manifest record with the status, output location, error and per-stage timings in seconds.
+    """
+    record = {"name": item["name"], "source": item["source"], "status": "succeeded", "timings": {}}
+    extension = get_file_extension(item["name"])
+    if extension not in AUDIO_EXTENSIONS and extension not in DOCUMENT_EXTENSIONS:
+        record.update(status="skipped", error=f"Unsupported file type: {extension}")
+        return record
+
+    stage = None
+    try:
+        stage = "extract"
+        started = time.perf_counter()
+        text_result = extract(item)
+        record["timings"]["extract"] = time.perf_counter() - started
+        record["text_chars"] = len(text_result)
+        if stop_after == "extract":
+            return record
+
+        from activities import callAiFoundry
+
+        stage = "aoai"
+        started = time.perf_counter()
+        aoai_output = callAiFoundry.call_aoai({
+            "text_result": text_result,
+            "instance_id": f"batch-{run_id}-{item['name']}"
+        })
+        record["timings"]["aoai"] = time.perf_counter() - started
+        record["partial"] = aoai_output["partial"]
+        if stop_after == "aoai":
+            return record
+
+        stage = "write"
+        started = time.perf_counter()
+        record["output"] = write(item, aoai_output, output_dir, final_output_container)
+        record["timings"]["write"] = time.perf_counter() - started
+
+    except Exception as e:
+        logging.error(f"main.py: {item['name']} failed in stage {stage}: {e}")
+        record.update(status="failed", failed_stage=stage, error_category=classify_exception(e), error=f"{type(e).__name__}: {e}")
+
+    return record
+
+
+def summarize(records, elapsed_seconds):
+    """Aggregate counts by status and per-stage timing statistics."""
+    summary = {
+        "items": len(records),
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "status": {},
+        "stages": {}
+    }
+    for record in records:
+        summary["status"][record["status"]] = summary["status"].get(record["status"], 0) + 1
+
+    for stage in STAGES:
+        timings = sorted(record["timings"][stage] for record in records if stage in record["timings"])
+        if not timings:
+            continue
+        summary["stages"][stage] = {
+            "count": len(timings),
+            "total_seconds": round(sum(timings), 3),
+            "mean_seconds": round(statistics.mean(timings), 3),
+            "p95_seconds": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            "max_seconds": round(timings[-1], 3)
+        }
+    return summary
+
+
+def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    extensions = [ext.strip().lower().lstrip(".") for ext in args.extensions.split(",")] if args.extensions else []
+    if args.input_dir:
+        items = discover_local(args.input_dir, extensions)
+    else:
+        items = discover_container(args.container, args.prefix, extensions)
+
+    final_output_container = args.output_container
+    if not args.output_dir and not final_output_container and args.stop_after == "write":
+        from configuration import Configuration
+        final_output_container = Configuration().get_value("FINAL_OUTPUT_CONTAINER")
+
+    manifest_path = args.manifest or f"results-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{run_id}.jsonl"
+    max_in_flight = max(args.max_in_flight, args.workers)
+    records = []
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor, \
+            open(manifest_path, "w", encoding="utf-8") as manifest, \
+            tqdm(unit="doc", desc=f"run {run_id}") as progress:
+        in_flight = set()
+
+        def drain(return_when):
+            done, pending = wait(in_flight, return_when=return_when)
+            for future in done:
+                record = future.result()
+                records.append(record)
+                manifest.write(json.dumps(record) + "\n")
+                progress.update(1)
+                progress.set_postfix(failed=sum(1 for r in records if r["status"] == "failed"))
+            return pending
+
+        for item in items:
+            if len(in_flight) >= max_in_flight:
+                in_flight = drain(FIRST_COMPLETED)
+            in_flight.add(executor.submit(
+                process_item, item, run_id, args.stop_after, args.output_dir, final_output_container
+            ))
+        if in_flight:
+            drain(ALL_COMPLETED)
+
+    summary = summarize(records, time.perf_counter() - started)
+    summary.update(run_id=run_id, manifest=manifest_path, stop_after=args.stop_after)
+    with open(f"{os.path.splitext(manifest_path)[0]}.summary.json", "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=2)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the document pipeline over a local directory or blob container without the Functions host.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="Local directory to process (recursively).")
+    source.add_argument("--container", help="Blob container to process, e.g. bronze.")
+    parser.add_argument("--prefix", help="Only process blobs whose name starts with this prefix (container mode).")
+    parser.add_argument("--extensions", help="Comma-separated file extensions to include, e.g. pdf,docx.")
+    parser.add_argument("--output-dir", help="Write outputs to this local directory instead of blob storage.")
+    parser.add_argument("--output-container", help="Output container (default: FINAL_OUTPUT_CONTAINER).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Worker processes (default: CPU count).")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="Maximum submitted but unfinished items (default: 4 x workers).")
+    parser.add_argument("--stop-after", choices=STAGES, default="write", help="Last stage to run, for profiling stages in isolation.")
+    parser.add_argument("--manifest", help="Path of the JSONL results manifest (default: results-<timestamp>-<run>.jsonl).")
+    args = parser.parse_args(argv)
+    if not args.max_in_flight:
+        args.max_in_flight = 4 * args.workers
+    return args
+
+
+def main(argv=None):
+    run(parse_args(argv))
 
 
 if __name__ == "__main__":
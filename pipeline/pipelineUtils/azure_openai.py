@@ -1,7 +1,10 @@
 from openai import AzureOpenAI
+import json
 import logging
 from azure.identity import get_bearer_token_provider
 from pipelineUtils.db import save_chat_message
+from pipelineUtils.errors import PermanentError
+from pipelineUtils.structured_output import get_response_format, get_schema, parse_output, build_reask_prompt
 from configuration import Configuration
 
 config = Configuration()
@@ -9,9 +12,20 @@ config = Configuration()
 OPENAI_API_BASE = config.get_value("OPENAI_API_BASE")
 OPENAI_MODEL = config.get_value("OPENAI_MODEL")
 OPENAI_API_VERSION = config.get_value("OPENAI_API_VERSION")
+# Re-asks only run when local repair cannot produce valid output
+STRUCTURED_OUTPUT_MAX_REASKS = int(config.get_value("STRUCTURED_OUTPUT_MAX_REASKS", "1"))
 
 
-def run_prompt(pipeline_id, system_prompt, user_prompt):
+def run_prompt(pipeline_id, system_prompt, user_prompt, base64_images=None, image_mime_type="image/png", response_format=None):
+    """
+    Send one chat completion and save the exchange to the conversation history.
+
+    Returns:
+        tuple: (assistant message, finish_reason). A finish_reason of "length" means the output was cut off.
+
+    Raises:
+        PermanentError: If the response has no content (content filter or refusal).
+    """
     token_provider = get_bearer_token_provider(  
         config.credential,  
         "https://cognitiveservices.azure.com/.default"  
@@ -31,12 +45,28 @@ def run_prompt(pipeline_id, system_prompt, user_prompt):
     save_chat_message(pipeline_id, "system", system_prompt)
     save_chat_message(pipeline_id, "user", user_prompt)
 
+    user_content = user_prompt
+    if base64_images:
+        user_content = [{"type": "text", "text": user_prompt}] + [
+            {"type": "image_url", "image_url": {"url": f"data:{image_mime_type};base64,{image}"}}
+            for image in base64_images
+        ]
+
+    # Structured output: constrain the completion to the prompt's JSON schema when one is configured
+    request_options = {"response_format": response_format} if response_format else {}
+
     try:
         response = openai_client.chat.completions.create(
             model=OPENAI_MODEL,
             messages=[{ "role": "system", "content": system_prompt},
-                {"role":"user","content":user_prompt}])
-        assistant_msg = response.choices[0].message.content
+                {"role":"user","content":user_content}],
+            **request_options)
+        choice = response.choices[0]
+        assistant_msg = choice.message.content
+        if assistant_msg is None:
+            # No content means the output was blocked by the content filter (or refused); retrying gives the same result
+            reason = getattr(choice.message, "refusal", None) or choice.finish_reason
+            raise PermanentError(f"Model returned no content for {pipeline_id} ({reason})")
         usage = {
             "prompt_tokens":   response.usage.prompt_tokens,
             "completion_tokens": response.usage.completion_tokens,
@@ -46,10 +76,58 @@ def run_prompt(pipeline_id, system_prompt, user_prompt):
 
         # 2) log the assistant’s response + usage
         save_chat_message(pipeline_id, "assistant", assistant_msg, usage)
-        return assistant_msg
+        return assistant_msg, choice.finish_reason
     
     except Exception as e:
         logging.error(f"Error calling OpenAI API: {e}")
         raise  # Re-raise to allow Durable Functions to retry
 
 
+def run_structured_prompt(pipeline_id, prompts, user_prompt, base64_images=None, image_mime_type="image/png"):
+    """
+    Run a prompt and return its output as valid JSON.
+
+    When the prompt config has a `json_schema`, it is sent as structured output and the response
+    is validated against it. Invalid output is repaired locally first; only if that fails is the
+    model re-asked (up to STRUCTURED_OUTPUT_MAX_REASKS times) with the validation errors and its
+    previous response, without the document text or images.
+
+    Output cut off at the token limit (finish_reason "length") is not re-asked, since a re-ask
+    would hit the same limit. Only then are open strings and brackets closed; if that makes it
+    valid it is returned marked as partial, otherwise the call fails permanently.
+
+    Returns:
+        tuple: (validated JSON string, partial) where partial is True if the output was cut off.
+
+    Raises:
+        PermanentError: If the output is still invalid after all re-asks, or was cut off and cannot be repaired.
+    """
+    response_format = get_response_format(prompts)
+    schema = get_schema(response_format)
+
+    response_content, finish_reason = run_prompt(
+        pipeline_id, prompts['system_prompt'], user_prompt,
+        base64_images=base64_images, image_mime_type=image_mime_type, response_format=response_format
+    )
+    result, errors, repairs = parse_output(response_content, schema, truncated=finish_reason == "length")
+
+    reasks = 0
+    while errors and finish_reason != "length" and reasks < STRUCTURED_OUTPUT_MAX_REASKS:
+        reasks += 1
+        logging.warning(f"Invalid model output for {pipeline_id}, re-ask {reasks}/{STRUCTURED_OUTPUT_MAX_REASKS}: {errors[:3]}")
+        reask_prompt = build_reask_prompt(response_content, errors)
+        response_content, finish_reason = run_prompt(pipeline_id, prompts['system_prompt'], reask_prompt, response_format=response_format)
+        result, errors, repairs = parse_output(response_content, schema, truncated=finish_reason == "length")
+
+    partial = finish_reason == "length"
+    if errors and partial:
+        raise PermanentError(f"Model output for {pipeline_id} was cut off at the token limit and could not be repaired: {'; '.join(errors[:5])}")
+    if errors:
+        raise PermanentError(f"Model returned invalid JSON for {pipeline_id} after {reasks} re-ask(s): {'; '.join(errors[:5])}")
+
+    if partial:
+        logging.warning(f"Model output for {pipeline_id} was cut off at the token limit; writing it as partial after repairs {repairs}")
+    elif repairs or reasks:
+        logging.info(f"Valid model output for {pipeline_id} after repairs {repairs} and {reasks} re-ask(s)")
+
+    return json.dumps(result, ensure_ascii=False), partial
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field, asdict, replace
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from azure.core.exceptions import ResourceExistsError
+
+from pipelineUtils.options import PipelineOptions
+from pipelineUtils.blob_functions import (
+    BlobMetadata,
+    list_blobs_page,
+    blob_exists,
+    get_blob_uri,
+    get_blob_content,
+    write_to_blob,
+    create_blob_if_missing,
+    acquire_blob_lease,
+    get_output_blob_name,
+    get_legacy_output_blob_name,
+)
+
+from configuration import Configuration
+config = Configuration()
+
+BACKFILL_CHECKPOINT_CONTAINER = config.get_value("BACKFILL_CHECKPOINT_CONTAINER", "backfill")
+
+# HTTP-triggered functions must respond within 230 seconds; leave room to save the checkpoint and reply
+DEFAULT_MAX_RUNTIME_SECONDS = 200
+MAX_RUNTIME_LIMIT_SECONDS = 210
+
+# The checkpoint lease is renewed well before it expires; a crashed run frees the job within a minute
+CHECKPOINT_LEASE_SECONDS = 60
+CHECKPOINT_LEASE_RENEW_SECONDS = 20
+
+
+class BackfillInProgressError(Exception):
+    """Raised when another run of the same backfill job holds the checkpoint lease."""
+
+
+class BackfillOptionsMismatchError(Exception):
+    """Raised when a job is resumed with different scan options than the run that created its checkpoint."""
+
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+@dataclass
+class BackfillOptions:
+    job_id: str
+    container: str = "bronze"
+    prefix: Optional[str] = None
+    modified_after: Optional[datetime] = None
+    modified_before: Optional[datetime] = None
+    extensions: List[str] = field(default_factory=list)
+    skip_existing: bool = True
+    final_output_container: Optional[str] = None
+    rate_per_second: float = 5.0
+    page_size: int = 500
+    max_runtime_seconds: int = DEFAULT_MAX_RUNTIME_SECONDS
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        if not data.get("job_id"):
+            raise ValueError("job_id is required to start or resume a backfill.")
+        return cls(
+            job_id=data["job_id"],
+            container=data.get("container", "bronze"),
+            prefix=data.get("prefix"),
+            modified_after=_parse_datetime(data.get("modified_after")),
+            modified_before=_parse_datetime(data.get("modified_before")),
+            extensions=[ext.lower().lstrip(".") for ext in data.get("extensions", [])],
+            skip_existing=data.get("skip_existing", True),
+            final_output_container=data.get("final_output_container"),
+            rate_per_second=float(data.get("rate_per_second", 5.0)),
+            page_size=int(data.get("page_size", 500)),
+            max_runtime_seconds=min(
+                int(data.get("max_runtime_seconds", DEFAULT_MAX_RUNTIME_SECONDS)),
+                MAX_RUNTIME_LIMIT_SECONDS
+            ),
+        )
+
+    def scan_options(self) -> dict:
+        """The options that decide which blobs the job visits and where its checkpoint position points."""
+        return {
+            "container": self.container,
+            "prefix": self.prefix,
+            "modified_after": self.modified_after.isoformat() if self.modified_after else None,
+            "modified_before": self.modified_before.isoformat() if self.modified_before else None,
+            "extensions": sorted(self.extensions),
+            "page_size": self.page_size,
+        }
+
+
+@dataclass
+class BackfillCheckpoint:
+    job_id: str
+    continuation_token: Optional[str] = None
+    page_offset: int = 0
+    scanned: int = 0
+    submitted: int = 0
+    skipped_filtered: int = 0
+    skipped_existing: int = 0
+    completed: bool = False
+    updated_at: Optional[str] = None
+    # Scan options of the run that started the job; page_offset is only meaningful for the same page_size
+    options: Optional[dict] = None
+
+    @property
+    def blob_path(self):
+        return f"{self.job_id}/checkpoint.json"
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def load_checkpoint(job_id: str) -> BackfillCheckpoint:
+    """Load the persisted checkpoint for a job, or a fresh one if the job has not run yet."""
+    checkpoint = BackfillCheckpoint(job_id=job_id)
+    if not blob_exists(BACKFILL_CHECKPOINT_CONTAINER, checkpoint.blob_path):
+        return checkpoint
+    data = json.loads(get_blob_content(BACKFILL_CHECKPOINT_CONTAINER, checkpoint.blob_path))
+    return BackfillCheckpoint(**data)
+
+
+def save_checkpoint(checkpoint: BackfillCheckpoint, lease=None):
+    checkpoint.updated_at = datetime.now(timezone.utc).isoformat()
+    write_to_blob(
+        BACKFILL_CHECKPOINT_CONTAINER,
+        checkpoint.blob_path,
+        json.dumps(checkpoint.to_dict()).encode("utf-8"),
+        lease=lease
+    )
+
+
+def lease_checkpoint(job_id: str):
+    """
+    Take the job's checkpoint lease so that only one run of a job submits blobs at a time.
+
+    The checkpoint blob is created first if the job has not run yet, since only existing blobs can be leased.
+    """
+    checkpoint = BackfillCheckpoint(job_id=job_id)
+    create_blob_if_missing(
+        BACKFILL_CHECKPOINT_CONTAINER,
+        checkpoint.blob_path,
+        json.dumps(checkpoint.to_dict()).encode("utf-8")
+    )
+    try:
+        return acquire_blob_lease(BACKFILL_CHECKPOINT_CONTAINER, checkpoint.blob_path, CHECKPOINT_LEASE_SECONDS)
+    except ResourceExistsError as e:
+        raise BackfillInProgressError(f"Backfill {job_id} is already running in another request.") from e
+
+
+class LeaseKeeper:
+    """Renews a blob lease once it is older than CHECKPOINT_LEASE_RENEW_SECONDS."""
+
+    def __init__(self, lease):
+        self.lease = lease
+        self.renewed_at = time.monotonic()
+
+    def keep_alive(self):
+        if time.monotonic() - self.renewed_at >= CHECKPOINT_LEASE_RENEW_SECONDS:
+            self.lease.renew()
+            self.renewed_at = time.monotonic()
+
+
+def has_output(container: str, blob_name: str, source_container: str) -> bool:
+    """
+    Check for an existing output under the current name or the `<stem>-output.json` name written
+    by earlier releases, so the first backfill after an upgrade does not reprocess everything.
+    """
+    return (
+        blob_exists(container, get_output_blob_name(blob_name, source_container))
+        or blob_exists(container, get_legacy_output_blob_name(blob_name))
+    )
+
+
+def matches_filters(blob, options: BackfillOptions) -> bool:
+    """Apply the modified-time window and extension filters (prefix is applied server-side)."""
+    if options.extensions:
+        extension = os.path.splitext(blob.name)[1].lower().lstrip(".")
+        if extension not in options.extensions:
+            return False
+    if options.modified_after and blob.last_modified < options.modified_after:
+        return False
+    if options.modified_before and blob.last_modified >= options.modified_before:
+        return False
+    return True
+
+
+class RateLimiter:
+    """Spaces submissions evenly so that at most `rate_per_second` are issued."""
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0
+        self.next_slot = time.monotonic()
+
+    async def wait(self):
+        now = time.monotonic()
+        if self.next_slot > now:
+            await asyncio.sleep(self.next_slot - now)
+        self.next_slot = max(self.next_slot, now) + self.interval
+
+
+async def run_backfill(client, options: BackfillOptions, pipeline_options: PipelineOptions) -> BackfillCheckpoint:
+    """
+    Submit `process_blob` orchestrations for existing blobs, resuming from the job's checkpoint.
+
+    The job's scan options (container, prefix, time window, extensions and page_size) are stored
+    in the checkpoint by the first run; resuming with different ones raises
+    BackfillOptionsMismatchError rather than continuing from a position that belongs to another
+    listing. Blob storage calls are synchronous and run in a worker thread so the event loop
+    stays free for the HTTP host.
+
+    The run stops after `max_runtime_seconds` (capped below the HTTP trigger's 230 second
+    response limit) and persists its position so it can be resumed by calling it again with the
+    same job_id. The checkpoint is saved after every page; if the host dies mid-page, at most
+    that page is resubmitted on resume. A lease on the checkpoint blob keeps two runs of the same
+    job from submitting the same blobs; the second raises BackfillInProgressError.
+
+    args:
+        client (DurableOrchestrationClient): The Durable Functions client used to start orchestrations.
+        options (BackfillOptions): Filters, throttling and job identity.
+        pipeline_options (PipelineOptions): Routing configuration passed to every orchestration started by this run.
+    response:
+        BackfillCheckpoint: The checkpoint after this run.
+    """
+    lease = await asyncio.to_thread(lease_checkpoint, options.job_id)
+    try:
+        return await _run_backfill(client, options, pipeline_options, LeaseKeeper(lease))
+    finally:
+        await asyncio.to_thread(lease.release)
+
+
+async def _run_backfill(client, options: BackfillOptions, pipeline_options: PipelineOptions, keeper: LeaseKeeper) -> BackfillCheckpoint:
+    checkpoint = await asyncio.to_thread(load_checkpoint, options.job_id)
+    scan_options = options.scan_options()
+    if checkpoint.options is None:
+        checkpoint.options = scan_options
+    elif checkpoint.options != scan_options:
+        raise BackfillOptionsMismatchError(
+            f"Backfill {options.job_id} was started with {checkpoint.options}; resume it with the same options "
+            f"or use a new job_id (got {scan_options})."
+        )
+
+    if checkpoint.completed:
+        logging.info(f"Backfill {options.job_id} already completed: {checkpoint.to_dict()}")
+        return checkpoint
+
+    if options.final_output_container:
+        pipeline_options = replace(pipeline_options, final_output_container=options.final_output_container)
+    final_output_container = pipeline_options.final_output_container
+    limiter = RateLimiter(options.rate_per_second)
+    deadline = time.monotonic() + options.max_runtime_seconds
+
+    while True:
+        await asyncio.to_thread(keeper.keep_alive)
+        blobs, next_token = await asyncio.to_thread(
+            list_blobs_page,
+            options.container,
+            name_starts_with=options.prefix,
+            continuation_token=checkpoint.continuation_token,
+            results_per_page=options.page_size
+        )
+
+        for index in range(checkpoint.page_offset, len(blobs)):
+            if time.monotonic() >= deadline:
+                checkpoint.page_offset = index
+                await asyncio.to_thread(save_checkpoint, checkpoint, keeper.lease)
+                logging.info(f"Backfill {options.job_id} paused: {checkpoint.to_dict()}")
+                return checkpoint
+
+            await asyncio.to_thread(keeper.keep_alive)
+            blob = blobs[index]
+            checkpoint.scanned += 1
+
+            if not matches_filters(blob, options):
+                checkpoint.skipped_filtered += 1
+                continue
+
+            if options.skip_existing and await asyncio.to_thread(
+                has_output, final_output_container, blob.name, options.container
+            ):
+                checkpoint.skipped_existing += 1
+                continue
+
+            await limiter.wait()
+            # Match the name format produced by the blob trigger ("<container>/<path>")
+            blob_metadata = BlobMetadata(
+                name=f"{options.container}/{blob.name}",
+                container=options.container,
+                uri=get_blob_uri(options.container, blob.name)
+            )
+            orchestration_input = {**blob_metadata.to_dict(), "options": pipeline_options.to_dict()}
+            instance_id = await client.start_new("process_blob", client_input=orchestration_input)
+            checkpoint.submitted += 1
+            logging.info(f"Backfill {options.job_id}: started orchestration {instance_id} for blob {blob.name}")
+
+        checkpoint.continuation_token = next_token
+        checkpoint.page_offset = 0
+        checkpoint.completed = next_token is None
+        await asyncio.to_thread(save_checkpoint, checkpoint, keeper.lease)
+
+        if checkpoint.completed:
+            logging.info(f"Backfill {options.job_id} completed: {checkpoint.to_dict()}")
+            return checkpoint
@@ -3,6 +3,7 @@ import logging
 from dataclasses import dataclass
 import json
 
+from azure.core.exceptions import ResourceExistsError
 from azure.identity import DefaultAzureCredential
 from azure.storage.blob import BlobServiceClient
 
@@ -31,12 +32,32 @@ class BlobMetadata:
         return json.dumps(self.to_dict(), ensure_ascii=False)
     
 
-def write_to_blob(container_name, blob_path, data):
+def normalize_blob_name(container: str, raw_name: str) -> str:
+    """Strip container prefix if included in the name."""
+    if raw_name.startswith(container + "/"):
+        return raw_name[len(container) + 1:]
+    return raw_name
+
+def write_to_blob(container_name, blob_path, data, metadata=None, lease=None):
 
     blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
-    blob_client.upload_blob(data, overwrite=True)
+    blob_client.upload_blob(data, overwrite=True, metadata=metadata, lease=lease)
     return True
 
+def create_blob_if_missing(container_name, blob_path, data):
+    """Create the blob with `data` unless it already exists. Returns True if it was created."""
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+    try:
+        blob_client.upload_blob(data, overwrite=False)
+    except ResourceExistsError:
+        return False
+    return True
+
+def acquire_blob_lease(container_name, blob_path, lease_duration=60):
+    """Acquire a lease on an existing blob; raises ResourceExistsError (409) if another caller holds it."""
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+    return blob_client.acquire_lease(lease_duration=lease_duration)
+
 def get_blob_content(container_name, blob_path):
 
     blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
@@ -44,11 +65,56 @@ def get_blob_content(container_name, blob_path):
     blob_content = blob_client.download_blob().readall()
     return blob_content
 
+def get_blob_range(container_name, blob_path, offset, length):
+    """Download `length` bytes starting at `offset` (fewer if the blob is shorter)."""
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+    return blob_client.download_blob(offset=offset, length=length).readall()
+
 def list_blobs(container_name):
     container_client = blob_service_client.get_container_client(container_name)
     blob_list = container_client.list_blobs()
     return blob_list
 
+def list_blobs_page(container_name, name_starts_with=None, continuation_token=None, results_per_page=500, include=None):
+    """Return one page of blobs and the continuation token for the next page (None when exhausted)."""
+    container_client = blob_service_client.get_container_client(container_name)
+    pages = container_client.list_blobs(
+        name_starts_with=name_starts_with,
+        include=include,
+        results_per_page=results_per_page
+    ).by_page(continuation_token=continuation_token)
+    page = next(pages, None)
+    if page is None:
+        return [], None
+    return list(page), pages.continuation_token
+
+def blob_exists(container_name, blob_path):
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+    return blob_client.exists()
+
+def get_blob_uri(container_name, blob_path):
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+    return blob_client.url
+
+def get_output_blob_name(blob_name, container=None):
+    """
+    Name of the output blob written to FINAL_OUTPUT_CONTAINER for a source blob.
+
+    The folder path and extension are kept so that e.g. a/report.pdf and b/report.docx
+    do not overwrite each other. A leading "<container>/" (as sent by the blob trigger) is dropped.
+    """
+    if container:
+        blob_name = normalize_blob_name(container, blob_name)
+    return f"{blob_name}-output.json"
+
+def get_legacy_output_blob_name(blob_name):
+    """Output name used before folders and extensions were kept: `<file stem>-output.json`."""
+    return f"{os.path.splitext(os.path.basename(blob_name))[0]}-output.json"
+
+def delete_blob(container_name, blob_path):
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+    blob_client.delete_blob()
+
 def delete_all_blobs_in_container(container_name):
     container_client = blob_service_client.get_container_client(container_name)
     blob_list = container_client.list_blobs()
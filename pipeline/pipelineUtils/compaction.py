@@ -0,0 +1,217 @@
+import io
+import json
+import time
+import logging
+from datetime import datetime, timezone
+from urllib.parse import unquote
+
+from pipelineUtils.blob_functions import (
+    list_blobs_page,
+    blob_exists,
+    get_blob_content,
+    write_to_blob,
+)
+
+from configuration import Configuration
+config = Configuration()
+
+FINAL_OUTPUT_CONTAINER = config.get_value("FINAL_OUTPUT_CONTAINER")
+GOLD_CONTAINER = config.get_value("GOLD_CONTAINER", "gold")
+COMPACTION_FORMAT = config.get_value("COMPACTION_FORMAT", "jsonl").lower()
+COMPACTION_MAX_RECORDS_PER_PART = int(config.get_value("COMPACTION_MAX_RECORDS_PER_PART", "50000"))
+# Work per run is bounded so the first run over a large output container fits the function timeout;
+# a pass over the container continues from the saved listing position on the next run
+COMPACTION_MAX_RECORDS_PER_RUN = int(config.get_value("COMPACTION_MAX_RECORDS_PER_RUN", "20000"))
+COMPACTION_MAX_RUNTIME_SECONDS = int(config.get_value("COMPACTION_MAX_RUNTIME_SECONDS", "180"))
+
+MANIFEST_PATH = "_manifest/index.json"
+
+
+def load_manifest():
+    """Load the gold manifest, which tracks the compaction watermark and every part file written."""
+    manifest = {"watermark": None, "pass_until": None, "continuation_token": None, "parts": []}
+    if blob_exists(GOLD_CONTAINER, MANIFEST_PATH):
+        manifest.update(json.loads(get_blob_content(GOLD_CONTAINER, MANIFEST_PATH)))
+    return manifest
+
+
+def save_manifest(manifest):
+    write_to_blob(GOLD_CONTAINER, MANIFEST_PATH, json.dumps(manifest, indent=2).encode("utf-8"))
+
+
+def partition_path(date: str, prompt_version: str) -> str:
+    return f"date={date}/prompt_version={prompt_version}"
+
+
+def to_record(blob, content: bytes) -> dict:
+    """Build one compacted record from a per-document output blob."""
+    metadata = blob.metadata or {}
+    text = content.decode("utf-8")
+    try:
+        result = json.loads(text)
+        valid_json = True
+    except json.JSONDecodeError:
+        result = text
+        valid_json = False
+    return {
+        "source_blob": unquote(metadata.get("source_blob", "")) or None,
+        "output_blob": blob.name,
+        "prompt_version": metadata.get("prompt_version", "unknown"),
+        "processed_at": blob.last_modified.isoformat(),
+        "valid_json": valid_json,
+        "partial": metadata.get("partial") == "true",
+        "result": result,
+    }
+
+
+def serialize_records(records, output_format: str) -> bytes:
+    if output_format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("COMPACTION_FORMAT=parquet requires the pyarrow package to be installed.")
+        # Results have arbitrary shape per prompt, so they are stored as a JSON string column
+        rows = [dict(record, result=json.dumps(record["result"], ensure_ascii=False)) for record in records]
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(rows), buffer, compression="zstd")
+        return buffer.getvalue()
+
+    lines = [json.dumps(record, ensure_ascii=False) for record in records]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class PartitionWriter:
+    """Buffers records per partition and flushes them to gold as numbered part files."""
+
+    def __init__(self, run_id: str, output_format: str, max_records_per_part: int):
+        self.run_id = run_id
+        self.output_format = output_format
+        self.max_records_per_part = max_records_per_part
+        self.buffers = {}
+        self.buffered = 0
+        self.part_numbers = {}
+        self.parts = []
+
+    def add(self, record: dict):
+        key = (record["processed_at"][:10], record["prompt_version"])
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(record)
+        self.buffered += 1
+
+    def flush(self, key):
+        records = self.buffers.pop(key, [])
+        if not records:
+            return
+        self.buffered -= len(records)
+        date, prompt_version = key
+        part_number = self.part_numbers.get(key, 0)
+        self.part_numbers[key] = part_number + 1
+
+        extension = "parquet" if self.output_format == "parquet" else "jsonl"
+        path = f"{partition_path(date, prompt_version)}/part-{self.run_id}-{part_number:05d}.{extension}"
+        data = serialize_records(records, self.output_format)
+        write_to_blob(GOLD_CONTAINER, path, data)
+
+        self.parts.append({
+            "path": path,
+            "date": date,
+            "prompt_version": prompt_version,
+            "format": self.output_format,
+            "records": len(records),
+            "bytes": len(data),
+            "min_processed_at": min(record["processed_at"] for record in records),
+            "max_processed_at": max(record["processed_at"] for record in records),
+        })
+        logging.info(f"compaction.py: Wrote {len(records)} records to {GOLD_CONTAINER}/{path}")
+
+    def flush_all(self):
+        """Write every buffered record and return the parts written since the last call."""
+        for key in list(self.buffers):
+            self.flush(key)
+        parts, self.parts = self.parts, []
+        return parts
+
+
+def compact_outputs(page_size: int = 1000, max_records: int = None, max_runtime_seconds: int = None) -> dict:
+    """
+    Append per-document outputs written since the last pass into partitioned gold part files.
+
+    A pass covers output blobs in FINAL_OUTPUT_CONTAINER modified in [watermark, pass_until),
+    where pass_until is the time the pass started. Records are grouped by processing date and
+    prompt version and written as JSONL (or Parquet) parts under
+    `date=YYYY-MM-DD/prompt_version=<version>/`.
+
+    Each run stops after `max_records` records or `max_runtime_seconds`, so a pass over a large
+    container spans several runs. Buffers are flushed at listing page boundaries once they reach
+    COMPACTION_MAX_RECORDS_PER_PART, and the manifest is saved after every flush with the new
+    parts and the listing position, so a timed-out run loses at most the pages since the last
+    flush. The watermark only moves once a pass has listed the whole container. Parts written
+    just before a crash may be rewritten by the next run; consumers should read the parts listed
+    in the manifest.
+
+    response:
+        dict: Summary of the run (records compacted, parts written, watermark, whether the pass finished).
+    """
+    max_records = COMPACTION_MAX_RECORDS_PER_RUN if max_records is None else max_records
+    max_runtime_seconds = COMPACTION_MAX_RUNTIME_SECONDS if max_runtime_seconds is None else max_runtime_seconds
+    deadline = time.monotonic() + max_runtime_seconds
+
+    manifest = load_manifest()
+    if not manifest["pass_until"]:
+        manifest["pass_until"] = datetime.now(timezone.utc).isoformat()
+        manifest["continuation_token"] = None
+    watermark = datetime.fromisoformat(manifest["watermark"]) if manifest["watermark"] else None
+    pass_until = datetime.fromisoformat(manifest["pass_until"])
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    writer = PartitionWriter(run_id, COMPACTION_FORMAT, COMPACTION_MAX_RECORDS_PER_PART)
+    compacted = 0
+    parts_written = 0
+    continuation_token = manifest["continuation_token"]
+
+    def commit(next_token):
+        # Parts are written before the manifest references them and the listing position moves past their records
+        nonlocal parts_written
+        parts = writer.flush_all()
+        parts_written += len(parts)
+        manifest["parts"].extend(parts)
+        manifest["continuation_token"] = next_token
+        if next_token is None:
+            manifest["watermark"] = manifest["pass_until"]
+            manifest["pass_until"] = None
+        save_manifest(manifest)
+
+    while True:
+        blobs, continuation_token = list_blobs_page(
+            FINAL_OUTPUT_CONTAINER,
+            continuation_token=continuation_token,
+            results_per_page=page_size,
+            include=["metadata"]
+        )
+        for blob in blobs:
+            if watermark and blob.last_modified < watermark:
+                continue
+            if blob.last_modified >= pass_until:
+                continue
+            content = get_blob_content(FINAL_OUTPUT_CONTAINER, blob.name)
+            writer.add(to_record(blob, content))
+            compacted += 1
+
+        if continuation_token is None:
+            commit(None)
+            break
+        if compacted >= max_records or time.monotonic() >= deadline:
+            commit(continuation_token)
+            break
+        if writer.buffered >= COMPACTION_MAX_RECORDS_PER_PART:
+            commit(continuation_token)
+
+    summary = {
+        "records": compacted,
+        "parts_written": parts_written,
+        "watermark": manifest["watermark"],
+        "pass_complete": manifest["pass_until"] is None,
+    }
+    logging.info(f"compaction.py: Compaction run {run_id} finished: {summary}")
+    return summary
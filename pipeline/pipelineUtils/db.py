@@ -16,6 +16,7 @@ config = Configuration()
 COSMOS_DB_URI = config.get_value("COSMOS_DB_URI")
 COSMOS_DB_DATABASE = config.get_value("COSMOS_DB_DATABASE_NAME")
 COSMOS_DB_CONVERSATION_CONTAINER = config.get_value("COSMOS_DB_CONVERSATION_HISTORY_CONTAINER")
+COSMOS_DB_STATUS_INDEX_CONTAINER = config.get_value("COSMOS_DB_STATUS_INDEX_CONTAINER", "pipelinestatus")
 
 
 def save_chat_message(conversation_id: str, role: str, content: str, usage: dict = None):
@@ -38,4 +39,15 @@ def save_chat_message(conversation_id: str, role: str, content: str, usage: dict
             "model": usage.get("model")
         })
 
-    return container.create_item(body=item)
\ No newline at end of file
+    return container.create_item(body=item)
+
+
+def save_status_records(records: list):
+    """Upsert per-blob orchestration status records into the status index container."""
+    client = CosmosClient(COSMOS_DB_URI, credential=config.credential)
+    db = client.get_database_client(COSMOS_DB_DATABASE)
+    container = db.get_container_client(COSMOS_DB_STATUS_INDEX_CONTAINER)
+
+    for record in records:
+        container.upsert_item(body=record)
+    return len(records)
@@ -0,0 +1,208 @@
+import re
+import wave
+import zipfile
+from dataclasses import dataclass
+from datetime import timedelta
+from xml.etree.ElementTree import ParseError
+
+import fitz  # PyMuPDF
+import requests
+
+TRANSIENT = "transient"
+THROTTLED = "throttled"
+PERMANENT = "permanent"
+FATAL = "fatal"
+
+RETRYABLE_CATEGORIES = {TRANSIENT, THROTTLED}
+
+# Activity failures reach the orchestrator as a message string, so the category is embedded in it
+CATEGORY_PATTERN = re.compile(r"\[(transient|throttled|permanent|fatal)\]")
+
+# Exceptions raised by the document itself (corrupt or malformed files); these quarantine the blob
+PERMANENT_EXCEPTIONS = (
+    zipfile.BadZipFile,
+    ParseError,
+    wave.Error,
+    UnicodeDecodeError,
+    fitz.FileDataError,  # a RuntimeError subclass: damaged or empty PDF
+)
+
+# Deployment problems rather than document problems: wrong credentials or role assignments still
+# propagating (401/403) and missing deployments, containers or endpoints (404)
+FATAL_STATUS_CODES = {401, 403, 404}
+
+# Status codes caused by the request content (payload too large, unsupported media type, unprocessable)
+PERMANENT_STATUS_CODES = {413, 415, 422}
+
+# Error codes of 400 responses that are caused by the document (content filter, too long for the model's
+# context window, unreadable or invalid content);
+# any other 400 (wrong api-version, unsupported parameter) is a deployment problem
+DOCUMENT_ERROR_CODES = {
+    "content_filter",
+    "context_length_exceeded",
+    "ResponsibleAIPolicyViolation",
+    "InvalidContent",
+    "InvalidContentLength",
+    "InvalidImage",
+    "InvalidImageSize",
+    "InvalidImageFormat",
+    "UnsupportedContent",
+}
+
+# Code errors fail the same way for every document, so they must not empty the input container
+FATAL_EXCEPTIONS = (
+    KeyError,
+    IndexError,
+    TypeError,
+    AttributeError,
+    NameError,  # includes UnboundLocalError
+    ImportError,
+)
+
+
+class PipelineError(Exception):
+    """An activity failure tagged with its retry category."""
+    category = TRANSIENT
+
+    def __init__(self, message, category=None):
+        super().__init__(message)
+        self.message = message
+        if category:
+            self.category = category
+
+    def __str__(self):
+        return f"[{self.category}] {self.message}"
+
+
+class TransientError(PipelineError):
+    category = TRANSIENT
+
+
+class ThrottledError(PipelineError):
+    category = THROTTLED
+
+
+class PermanentError(PipelineError):
+    """The document itself cannot be processed; the blob is quarantined."""
+    category = PERMANENT
+
+
+class FatalError(PipelineError):
+    """The pipeline cannot run (credentials, settings, prompts, code); the orchestration fails and the blob stays in place."""
+    category = FATAL
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def _is_document_error(exc) -> bool:
+    # OpenAI errors carry `code`, Azure SDK errors `error_code` or `error.code`
+    codes = {
+        getattr(exc, "code", None),
+        getattr(exc, "error_code", None),
+        getattr(getattr(exc, "error", None), "code", None),
+    }
+    if codes & DOCUMENT_ERROR_CODES:
+        return True
+    message = str(exc)
+    return any(code in message for code in DOCUMENT_ERROR_CODES)
+
+
+def classify_exception(exc) -> str:
+    """
+    Return the retry category of an exception.
+
+    HTTP errors (Azure SDK, OpenAI, requests) are classified by status code: 429 is throttled,
+    408 and 5xx are transient, 401/403/404 are fatal (a deployment problem, not the document),
+    and 413/415/422 and 400s with a document error code (e.g. a content-filter rejection) are
+    permanent. Other 400s are fatal. Connection problems are transient, corrupt files are
+    permanent and code errors are fatal.
+    """
+    if isinstance(exc, PipelineError):
+        return exc.category
+
+    status = _status_code(exc)
+    if status is not None:
+        if status == 429:
+            return THROTTLED
+        if status == 408 or status >= 500:
+            return TRANSIENT
+        if status in FATAL_STATUS_CODES:
+            return FATAL
+        if status in PERMANENT_STATUS_CODES:
+            return PERMANENT
+        if status == 400:
+            return PERMANENT if _is_document_error(exc) else FATAL
+        if 400 <= status < 500:
+            return TRANSIENT
+
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return TRANSIENT
+    if isinstance(exc, PERMANENT_EXCEPTIONS):
+        return PERMANENT
+    if isinstance(exc, FATAL_EXCEPTIONS):
+        return FATAL
+    return TRANSIENT
+
+
+def to_pipeline_error(exc) -> PipelineError:
+    """Wrap an exception so the orchestrator can read its category; re-raise with `raise to_pipeline_error(e) from e`."""
+    if isinstance(exc, PipelineError):
+        return exc
+    return PipelineError(f"{type(exc).__name__}: {exc}", classify_exception(exc))
+
+
+def parse_error_category(message: str) -> str:
+    """Read the category from a failed activity's message; untagged failures are treated as transient."""
+    match = CATEGORY_PATTERN.search(message or "")
+    return match.group(1) if match else TRANSIENT
+
+
+class ActivityFailedError(Exception):
+    """Raised in the orchestrator when an activity fails permanently or runs out of attempts."""
+
+    def __init__(self, activity_name, category, message):
+        super().__init__(f"{activity_name} failed ({category}): {message}")
+        self.activity_name = activity_name
+        self.category = category
+        self.message = message
+
+
+@dataclass(frozen=True)
+class ActivityRetryPolicy:
+    max_attempts: int = 5
+    transient_first_delay_seconds: int = 5
+    throttled_first_delay_seconds: int = 30
+    max_delay_seconds: int = 300
+
+    def delay(self, category: str, attempt: int) -> timedelta:
+        first_delay = self.throttled_first_delay_seconds if category == THROTTLED else self.transient_first_delay_seconds
+        return timedelta(seconds=min(first_delay * 2 ** (attempt - 1), self.max_delay_seconds))
+
+
+DEFAULT_RETRY_POLICY = ActivityRetryPolicy()
+
+
+def call_activity_classified(context, name, activity_input, policy: ActivityRetryPolicy = DEFAULT_RETRY_POLICY):
+    """
+    Orchestrator helper (use with `yield from`) that only retries retryable failures.
+
+    Transient and throttled failures are retried with exponential backoff using durable timers
+    (throttled starts with a longer delay). Permanent and fatal failures raise ActivityFailedError
+    immediately instead of spending more attempts on paid calls.
+    """
+    attempt = 1
+    while True:
+        try:
+            result = yield context.call_activity(name, activity_input)
+            return result
+        except Exception as e:
+            category = parse_error_category(str(e))
+            if category not in RETRYABLE_CATEGORIES or attempt >= policy.max_attempts:
+                raise ActivityFailedError(name, category, str(e))
+            yield context.create_timer(context.current_utc_datetime + policy.delay(category, attempt))
+            attempt += 1
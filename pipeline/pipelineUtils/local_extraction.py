@@ -0,0 +1,216 @@
+import io
+import re
+import logging
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List
+
+import fitz  # PyMuPDF
+
+from pipelineUtils.token_reduction import TextBlock
+
+LOCAL_EXTENSIONS = ['pdf', 'docx', 'xlsx', 'pptx']
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+DRAWING_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+
+
+@dataclass
+class LocalExtractionOptions:
+    enabled: bool = True
+    min_chars_per_page: int = 50
+    parallel_min_pages: int = 40
+    max_workers: int = 4
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            enabled=config.read_env_boolean("LOCAL_EXTRACTION_ENABLED", True),
+            min_chars_per_page=int(config.get_value("LOCAL_EXTRACTION_MIN_CHARS_PER_PAGE", "50")),
+            parallel_min_pages=int(config.get_value("LOCAL_EXTRACTION_PARALLEL_MIN_PAGES", "40")),
+            max_workers=int(config.get_value("LOCAL_EXTRACTION_MAX_WORKERS", "4")),
+        )
+
+
+@dataclass
+class LocalExtractionResult:
+    blocks: List[TextBlock] = field(default_factory=list)
+    # 1-based page numbers without a usable text layer; these still need OCR
+    ocr_pages: List[int] = field(default_factory=list)
+    # Office "pages" (sheets, slides) are not printed pages, so they have no running headers or page numbers
+    paginated: bool = True
+
+
+def _has_text_layer(text: str, min_chars: int) -> bool:
+    stripped = text.strip()
+    if len(stripped) < min_chars:
+        return False
+    # Pages with broken font encodings extract as replacement characters
+    return stripped.count("�") / len(stripped) < 0.1
+
+
+def _extract_pdf_page_range(content: bytes, start: int, end: int, min_chars: int):
+    """Extract pages [start, end) of a PDF. Runs in a worker process for large documents."""
+    pages = []
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        for index in range(start, end):
+            page = doc[index]
+            if not _has_text_layer(page.get_text(), min_chars):
+                pages.append((index + 1, None))
+                continue
+            # (x0, y0, x1, y1, text, block_no, block_type); block_type 0 is text
+            blocks = [block[4] for block in page.get_text("blocks", sort=True) if block[6] == 0]
+            pages.append((index + 1, blocks))
+    return pages
+
+
+def extract_pdf(content: bytes, options: LocalExtractionOptions) -> LocalExtractionResult:
+    """Extract the embedded text layer of a PDF, splitting large documents across a process pool."""
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        page_count = doc.page_count
+
+    if page_count >= options.parallel_min_pages and options.max_workers > 1:
+        chunk_size = -(-page_count // options.max_workers)
+        ranges = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+        with ProcessPoolExecutor(max_workers=options.max_workers) as executor:
+            futures = [
+                executor.submit(_extract_pdf_page_range, content, start, end, options.min_chars_per_page)
+                for start, end in ranges
+            ]
+            pages = [page for future in futures for page in future.result()]
+    else:
+        pages = _extract_pdf_page_range(content, 0, page_count, options.min_chars_per_page)
+
+    result = LocalExtractionResult()
+    for page_number, blocks in pages:
+        if blocks is None:
+            result.ocr_pages.append(page_number)
+        else:
+            result.blocks.extend(TextBlock(text, page_number) for text in blocks)
+    return result
+
+
+def build_pdf_subset(content: bytes, page_numbers: List[int]) -> bytes:
+    """Return a PDF containing only the given 1-based pages, in order."""
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        doc.select([page_number - 1 for page_number in page_numbers])
+        return doc.tobytes()
+
+
+def _element_text(element, text_tag: str) -> str:
+    return "".join(node.text or "" for node in element.iter(text_tag))
+
+
+def _docx_block_elements(parent):
+    """Yield the body's paragraphs and tables in order, including those wrapped in content controls (w:sdt) or custom XML."""
+    for element in parent:
+        if element.tag == f"{WORD_NS}sdt":
+            content = element.find(f"{WORD_NS}sdtContent")
+            if content is not None:
+                yield from _docx_block_elements(content)
+        elif element.tag == f"{WORD_NS}customXml":
+            yield from _docx_block_elements(element)
+        else:
+            yield element
+
+
+def extract_docx(content: bytes) -> LocalExtractionResult:
+    """Extract body paragraphs and tables from a DOCX. Word files have no fixed pages, so all blocks are on page 1."""
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        root = ET.fromstring(archive.read("word/document.xml"))
+
+    result = LocalExtractionResult(paginated=False)
+    body = root.find(f"{WORD_NS}body")
+    for element in _docx_block_elements(body) if body is not None else []:
+        if element.tag == f"{WORD_NS}p":
+            text = _element_text(element, f"{WORD_NS}t")
+        elif element.tag == f"{WORD_NS}tbl":
+            rows = [
+                "|" + "|".join(_element_text(cell, f"{WORD_NS}t") for cell in row.iter(f"{WORD_NS}tc")) + "|"
+                for row in element.iter(f"{WORD_NS}tr")
+            ]
+            text = "\n".join(rows)
+        else:
+            continue
+        if text.strip():
+            result.blocks.append(TextBlock(text, 1))
+    return result
+
+
+def extract_xlsx(content: bytes) -> LocalExtractionResult:
+    """Extract cell values from every worksheet; each sheet is treated as one page."""
+    result = LocalExtractionResult(paginated=False)
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        shared_strings = []
+        if "xl/sharedStrings.xml" in archive.namelist():
+            strings_root = ET.fromstring(archive.read("xl/sharedStrings.xml"))
+            shared_strings = [_element_text(item, f"{SHEET_NS}t") for item in strings_root.iter(f"{SHEET_NS}si")]
+
+        sheets = sorted(
+            (name for name in archive.namelist() if re.match(r"xl/worksheets/sheet\d+\.xml$", name)),
+            key=lambda name: int(re.search(r"(\d+)\.xml$", name).group(1))
+        )
+        for page_number, sheet in enumerate(sheets, start=1):
+            root = ET.fromstring(archive.read(sheet))
+            for row in root.iter(f"{SHEET_NS}row"):
+                values = []
+                for cell in row.iter(f"{SHEET_NS}c"):
+                    cell_type = cell.get("t")
+                    if cell_type == "inlineStr":
+                        values.append(_element_text(cell, f"{SHEET_NS}t"))
+                        continue
+                    value = cell.find(f"{SHEET_NS}v")
+                    if value is None or value.text is None:
+                        values.append("")
+                    elif cell_type == "s":
+                        values.append(shared_strings[int(value.text)])
+                    else:
+                        values.append(value.text)
+                if any(values):
+                    result.blocks.append(TextBlock("|" + "|".join(values) + "|", page_number))
+    return result
+
+
+def extract_pptx(content: bytes) -> LocalExtractionResult:
+    """Extract the text of every slide, one page per slide."""
+    result = LocalExtractionResult(paginated=False)
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        slides = sorted(
+            (name for name in archive.namelist() if re.match(r"ppt/slides/slide\d+\.xml$", name)),
+            key=lambda name: int(re.search(r"(\d+)\.xml$", name).group(1))
+        )
+        for page_number, slide in enumerate(slides, start=1):
+            root = ET.fromstring(archive.read(slide))
+            for paragraph in root.iter(f"{DRAWING_NS}p"):
+                text = _element_text(paragraph, f"{DRAWING_NS}t")
+                if text.strip():
+                    result.blocks.append(TextBlock(text, page_number))
+    return result
+
+
+def extract_local(extension: str, content: bytes, options: LocalExtractionOptions) -> LocalExtractionResult:
+    """
+    Extract text in-process for born-digital files.
+
+    PDF pages without a usable text layer are reported in `ocr_pages`. Office files are
+    parsed natively; if one yields no text at all (e.g. a scanned image pasted into a
+    DOCX) every page is reported for OCR so the caller falls back to Document Intelligence.
+    """
+    if extension == "pdf":
+        result = extract_pdf(content, options)
+    elif extension == "docx":
+        result = extract_docx(content)
+    elif extension == "xlsx":
+        result = extract_xlsx(content)
+    elif extension == "pptx":
+        result = extract_pptx(content)
+    else:
+        raise ValueError(f"Local extraction does not support .{extension} files")
+
+    if extension != "pdf" and not result.blocks:
+        result.ocr_pages = [1]
+    logging.info(f"local_extraction.py: Extracted {len(result.blocks)} blocks locally, {len(result.ocr_pages)} page(s) need OCR")
+    return result
@@ -0,0 +1,40 @@
+from dataclasses import dataclass, asdict
+
+PIPELINE_OPTIONS_VERSION = 1
+
+
+@dataclass(frozen=True)
+class PipelineOptions:
+    """
+    Routing configuration resolved once when an orchestration is started.
+
+    The options travel in the orchestration input so the orchestrator never reads
+    App Configuration: replays stay cheap and deterministic, and a configuration change
+    only affects orchestrations started after it.
+    """
+    multi_modal: bool = False
+    vision_enabled: bool = False
+    final_output_container: str = "silver"
+    version: int = PIPELINE_OPTIONS_VERSION
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            multi_modal=config.read_env_boolean("AOAI_MULTI_MODAL"),
+            vision_enabled=config.read_env_boolean("AI_VISION_ENABLED"),
+            final_output_container=config.get_value("FINAL_OUTPUT_CONTAINER"),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        version = data.get("version", PIPELINE_OPTIONS_VERSION)
+        if version != PIPELINE_OPTIONS_VERSION:
+            raise ValueError(f"Unsupported pipeline options version: {version}")
+        return cls(
+            multi_modal=data.get("multi_modal", False),
+            vision_enabled=data.get("vision_enabled", False),
+            final_output_container=data.get("final_output_container", "silver"),
+        )
+
+    def to_dict(self):
+        return asdict(self)
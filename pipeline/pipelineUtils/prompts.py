@@ -1,6 +1,8 @@
 import os
 import json
+import hashlib
 from pipelineUtils.blob_functions import get_blob_content
+from pipelineUtils.errors import FatalError
 import yaml
 import logging
 
@@ -32,21 +34,36 @@ def load_prompts_from_blob(prompt_file):
     
 
 def load_prompts():
-    """Fetch prompts JSON from blob storage and return as a dictionary."""
+    """
+    Fetch prompts JSON from blob storage and return as a dictionary.
+
+    Any failure is a deployment problem, not a document problem, so it is raised as FatalError:
+    the orchestration fails and the blob is not quarantined.
+    """
     prompt_file = config.get_value("PROMPT_FILE")
     
     if not prompt_file:
-        raise ValueError("Environment variable PROMPT_FILE is not set.")
+        raise FatalError("Environment variable PROMPT_FILE is not set.")
     
-    if prompt_file=="COSMOS":
-        prompts = load_prompts_from_cosmos()
-    else:
-        prompts = load_prompts_from_blob(prompt_file)
+    try:
+        if prompt_file=="COSMOS":
+            prompts = load_prompts_from_cosmos()
+        else:
+            prompts = load_prompts_from_blob(prompt_file)
+    except Exception as e:
+        raise FatalError(str(e)) from e
 
     # Validate required fields
     required_keys = ["system_prompt", "user_prompt"]
     for key in required_keys:
         if key not in prompts:
-            raise KeyError(f"Missing required prompt key: {key}")
+            raise FatalError(f"Missing required prompt key: {key}")
+
+    return prompts
 
-    return prompts
\ No newline at end of file
+def get_prompt_version(prompts):
+    """Return the prompt version: the explicit `version` key if set, otherwise a short hash of the prompt text."""
+    if prompts.get("version"):
+        return str(prompts["version"])
+    prompt_text = prompts["system_prompt"] + "\n" + prompts["user_prompt"]
+    return hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()[:12]
@@ -0,0 +1,10 @@
+# Audio file extensions
+AUDIO_EXTENSIONS = ['wav', 'mp3', 'opus', 'ogg', 'flac', 'wma', 'aac', 'webm']
+# Document file extensions
+DOCUMENT_EXTENSIONS = ['pdf', 'docx', 'doc', 'xlsx', 'pptx', 'jpg', 'jpeg', 'png', 'tiff', 'bmp']
+# Document extensions the multi-modal activity can send to the model as images
+MULTIMODAL_EXTENSIONS = ['pdf', 'png', 'jpg', 'jpeg']
+
+
+def get_file_extension(blob_name: str) -> str:
+    return blob_name.lower().split('.')[-1] if '.' in blob_name else ""
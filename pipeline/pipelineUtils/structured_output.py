@@ -0,0 +1,283 @@
+import re
+import json
+import logging
+
+DEFAULT_SCHEMA_NAME = "pipeline_output"
+
+FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)\n?\s*```", re.DOTALL)
+DANGLING_KEY_PATTERN = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+# Cap on the validation errors listed in a re-ask; the first few are enough for the model to fix the output
+MAX_REPORTED_ERRORS = 20
+
+
+def get_response_format(prompts):
+    """
+    Build the chat completions `response_format` from the optional `json_schema` prompt key.
+
+    The key holds either a bare JSON schema or an OpenAI-style wrapper with `name`, `strict` and
+    `schema`. Returns None when the prompt config has no schema.
+    """
+    json_schema = prompts.get("json_schema")
+    if not json_schema:
+        return None
+
+    if "schema" in json_schema:
+        wrapper = dict(json_schema)
+    else:
+        wrapper = {"schema": json_schema}
+    wrapper.setdefault("name", DEFAULT_SCHEMA_NAME)
+    wrapper.setdefault("strict", True)
+    return {"type": "json_schema", "json_schema": wrapper}
+
+
+def get_schema(response_format):
+    """Return the JSON schema of a response format built by `get_response_format`, or None."""
+    if not response_format:
+        return None
+    return response_format["json_schema"]["schema"]
+
+
+def strip_code_fences(text: str) -> str:
+    """Return the content of the first ```json fence, or the text from the first `{`/`[` when there is leading prose."""
+    match = FENCE_PATTERN.search(text)
+    if match:
+        return match.group(1).strip()
+
+    # An unterminated fence, e.g. a response cut off by max_tokens
+    text = re.sub(r"^\s*```(?:json|JSON)?\s*", "", text)
+    starts = [index for index in (text.find("{"), text.find("[")) if index != -1]
+    return text[min(starts):].strip() if starts else text.strip()
+
+
+def remove_trailing_commas(text: str) -> str:
+    """Remove commas directly before a closing `}` or `]`, leaving string contents untouched."""
+    output = []
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            output.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char == ",":
+            next_index = index + 1
+            while next_index < len(text) and text[next_index].isspace():
+                next_index += 1
+            if next_index < len(text) and text[next_index] in "}]":
+                continue
+        output.append(char)
+    return "".join(output)
+
+
+def close_truncated(text: str) -> str:
+    """
+    Complete JSON that was cut off mid-output.
+
+    Closes an open string, drops a dangling `,` or a key without a value, and appends the
+    closing brackets still open. Values that were cut off inside a literal (e.g. `tru`) are not
+    recovered; validation reports those. The result is valid but incomplete, so callers must
+    flag output that hit the token limit as partial.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        # Drop a dangling escape character before closing the string
+        text = (text[:-1] if escaped else text) + '"'
+
+    text = text.rstrip()
+    if stack and stack[-1] == "}":
+        # `{"a": 1, "b"` or `{"a": 1, "b":` - the last key has no value
+        match = DANGLING_KEY_PATTERN.search(text)
+        if match:
+            text = text[:match.start()] + ("{" if match.group(1) == "{" else "")
+    text = text.rstrip().rstrip(",").rstrip()
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text: str, truncated: bool = False):
+    """
+    Parse model output, applying deterministic repairs only as far as needed.
+
+    Repairs, in order: code fence and leading prose stripping, trailing comma removal and, when
+    `truncated` is set (the response hit the token limit), truncation recovery. Output that
+    stopped normally is never cut back to a valid prefix; it is left for a re-ask instead.
+
+    Returns:
+        tuple: (parsed value, list of the repairs that were applied).
+
+    Raises:
+        json.JSONDecodeError: If the output is still not valid JSON after all repairs.
+    """
+    repairs = []
+    candidate = text.strip()
+    steps = [
+        ("strip_code_fences", strip_code_fences),
+        ("remove_trailing_commas", remove_trailing_commas),
+    ]
+    if truncated:
+        steps.append(("close_truncated", close_truncated))
+
+    try:
+        return json.loads(candidate), repairs
+    except json.JSONDecodeError as e:
+        error = e
+
+    for repair_name, repair in steps:
+        repaired = repair(candidate)
+        if repaired == candidate:
+            continue
+        candidate = repaired
+        repairs.append(repair_name)
+        try:
+            value = json.loads(candidate)
+            logging.info(f"structured_output.py: Repaired model output with {repairs}")
+            return value, repairs
+        except json.JSONDecodeError as e:
+            error = e
+
+    raise error
+
+
+def _is_type(value, schema_type) -> bool:
+    # bool is a subclass of int in Python but not a JSON number
+    if schema_type in ("integer", "number") and isinstance(value, bool):
+        return False
+    if schema_type == "integer" and isinstance(value, float):
+        return value.is_integer()
+    return isinstance(value, JSON_TYPES.get(schema_type, object))
+
+
+def validate(value, schema: dict, path: str = "$") -> list:
+    """
+    Validate a parsed value against the subset of JSON schema that structured outputs supports.
+
+    Checks type, enum, const, required, properties, additionalProperties, items, anyOf,
+    minItems/maxItems and local `$ref`s to `$defs`. Other keywords are ignored.
+
+    Returns:
+        list: Human-readable errors with a JSON path; empty when the value is valid.
+    """
+    return _validate(value, schema, path, schema)
+
+
+def _resolve_ref(schema, root):
+    ref = schema.get("$ref")
+    if not ref:
+        return schema
+    if not ref.startswith("#/"):
+        raise ValueError(f"Only local schema references are supported: {ref}")
+    resolved = root
+    for part in ref[2:].split("/"):
+        resolved = resolved[part]
+    return resolved
+
+
+def _validate(value, schema, path, root):
+    schema = _resolve_ref(schema, root)
+    errors = []
+
+    if "anyOf" in schema:
+        branches = [_validate(value, option, path, root) for option in schema["anyOf"]]
+        if all(branches):
+            errors.append(f"{path}: does not match any allowed schema ({branches[0][0]})")
+        return errors
+
+    schema_type = schema.get("type")
+    if schema_type:
+        types = schema_type if isinstance(schema_type, list) else [schema_type]
+        if not any(_is_type(value, t) for t in types):
+            return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if "const" in schema and value != schema["const"]:
+        errors.append(f"{path}: expected {schema['const']!r}")
+
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required property '{key}'")
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(_validate(item, properties[key], f"{path}.{key}", root))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected property '{key}'")
+
+    if isinstance(value, list):
+        if "minItems" in schema and len(value) < schema["minItems"]:
+            errors.append(f"{path}: expected at least {schema['minItems']} items, got {len(value)}")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items, got {len(value)}")
+        if "items" in schema:
+            for index, item in enumerate(value):
+                errors.extend(_validate(item, schema["items"], f"{path}[{index}]", root))
+
+    return errors
+
+
+def parse_output(text: str, schema: dict = None, truncated: bool = False):
+    """
+    Repair, parse and validate model output. Set `truncated` when the response hit the token limit.
+
+    Returns:
+        tuple: (parsed value or None, list of errors, list of repairs applied). The value is None
+        when the output could not be parsed even after repairs.
+    """
+    try:
+        value, repairs = repair_json(text, truncated)
+    except json.JSONDecodeError as e:
+        return None, [f"Output is not valid JSON: {e}"], []
+
+    errors = validate(value, schema) if schema else []
+    return value, errors, repairs
+
+
+def build_reask_prompt(previous_output: str, errors: list) -> str:
+    """Build a correction prompt from the rejected output and its errors only; the source document is not resent."""
+    listed = errors[:MAX_REPORTED_ERRORS]
+    if len(errors) > len(listed):
+        listed.append(f"... and {len(errors) - len(listed)} more")
+    error_text = "\n".join(f"- {error}" for error in listed)
+    return (
+        "Your previous response could not be used because it failed validation:\n"
+        f"{error_text}\n\n"
+        "Return the corrected JSON only, with no explanation and no code fences. "
+        "Keep every value that was not affected by the errors unchanged.\n\n"
+        f"Previous response:\n{previous_output}"
+    )
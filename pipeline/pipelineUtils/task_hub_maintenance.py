@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+from azure.durable_functions import OrchestrationRuntimeStatus
+from azure.durable_functions.models.DurableOrchestrationStatus import DurableOrchestrationStatus
+from azure.durable_functions.models.RpcManagementOptions import RpcManagementOptions
+
+from pipelineUtils.db import save_status_records
+from pipelineUtils.errors import parse_error_category
+
+from configuration import Configuration
+config = Configuration()
+
+TASK_HUB_RETENTION_DAYS = int(config.get_value("TASK_HUB_RETENTION_DAYS", "7"))
+TASK_HUB_PURGE_MAX_INSTANCES = int(config.get_value("TASK_HUB_PURGE_MAX_INSTANCES", "5000"))
+TASK_HUB_PURGE_PAGE_SIZE = int(config.get_value("TASK_HUB_PURGE_PAGE_SIZE", "100"))
+
+CONTINUATION_TOKEN_HEADER = "x-ms-continuation-token"
+
+PURGEABLE_STATUSES = [
+    OrchestrationRuntimeStatus.Completed,
+    OrchestrationRuntimeStatus.Failed,
+    OrchestrationRuntimeStatus.Terminated,
+]
+
+# Keep failure messages in the index short; the full history is gone after the purge
+MAX_ERROR_LENGTH = 2000
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def build_status_record(status) -> dict:
+    """
+    Build a compact status index record from a finished orchestration.
+
+    For process_blob this is one record per blob: instance id, blob, output blob, stage timings
+    and, for failures, the error class (transient, throttled or permanent).
+    """
+    runtime_status = getattr(status.runtime_status, "value", status.runtime_status)
+    blob_input = status.input_ if isinstance(status.input_, dict) else {}
+    output = status.output if isinstance(status.output, dict) else {}
+    blob = output["blob"] if isinstance(output.get("blob"), dict) else blob_input
+
+    record = {
+        "id": status.instance_id,
+        "instanceId": status.instance_id,
+        "orchestration": status.name,
+        "runtimeStatus": runtime_status,
+        "createdTime": _isoformat(status.created_time),
+        "lastUpdatedTime": _isoformat(status.last_updated_time),
+        "blob": blob.get("name"),
+        "status": output.get("status", "succeeded" if runtime_status == "Completed" else runtime_status.lower()),
+        "outputBlob": (output.get("task_result") or {}).get("output_blob"),
+        "stageTimings": output.get("stage_timings"),
+        "errorClass": None,
+        "error": None,
+    }
+
+    if isinstance(output.get("error"), dict):
+        record["errorClass"] = output["error"].get("category")
+        record["error"] = output["error"].get("message", "")[:MAX_ERROR_LENGTH]
+    elif output.get("error"):
+        record["error"] = str(output["error"])[:MAX_ERROR_LENGTH]
+    elif runtime_status == "Failed":
+        # A failed orchestration's output is the failure message
+        message = str(status.output or "")
+        record["errorClass"] = parse_error_category(message)
+        record["error"] = message[:MAX_ERROR_LENGTH]
+
+    return record
+
+
+async def query_status_page(client, cutoff, top: int, continuation_token: str = None):
+    """
+    Return one page of finished instances created before `cutoff`, with their inputs, and the next continuation token.
+
+    The SDK's get_status_by makes a single request without `showInput`, `top` or a continuation
+    token, so the same Durable Functions management endpoint is paged here directly.
+    """
+    options = RpcManagementOptions(created_time_to=cutoff, runtime_status=PURGEABLE_STATUSES, show_input=True)
+    url = f"{options.to_url(client._orchestration_bindings.rpc_base_url)}&top={top}"
+    headers = {CONTINUATION_TOKEN_HEADER: continuation_token} if continuation_token else {}
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers=headers) as response:
+            if response.status != 200:
+                raise Exception(f"Instance query failed with status code {response.status}: {await response.text()}")
+            statuses = await response.json(content_type=None) or []
+            next_token = response.headers.get(CONTINUATION_TOKEN_HEADER)
+
+    # The extension sends the literal "null" once the last page has been returned
+    if next_token in ("", "null"):
+        next_token = None
+    return [DurableOrchestrationStatus.from_json(status) for status in statuses], next_token
+
+
+async def purge_task_hub_history(client, retention_days: int = None, max_instances: int = None, page_size: int = None) -> dict:
+    """
+    Index and purge finished orchestration instances older than the retention period.
+
+    Completed, failed and terminated instances created before the cutoff are read one page at a
+    time. Each page is written to the status index first and only then purged, so no instance is
+    purged without a record and memory stays bounded by the page size. At most `max_instances`
+    are handled per run; the remainder is picked up by the next run.
+
+    Instances are purged individually rather than with purge_instance_history_by, which would
+    also delete instances beyond the per-run cap that have not been indexed yet.
+
+    args:
+        client (DurableOrchestrationClient): The Durable Functions client.
+        retention_days (int): Instances created more than this many days ago are purged.
+        max_instances (int): Maximum number of instances to index and purge in this run.
+        page_size (int): Number of instances read, indexed and purged at a time.
+    response:
+        dict: Counts of indexed and purged instances and the cutoff used.
+    """
+    retention_days = TASK_HUB_RETENTION_DAYS if retention_days is None else retention_days
+    max_instances = TASK_HUB_PURGE_MAX_INSTANCES if max_instances is None else max_instances
+    page_size = TASK_HUB_PURGE_PAGE_SIZE if page_size is None else page_size
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+
+    indexed = 0
+    purged = 0
+    continuation_token = None
+    while indexed < max_instances:
+        statuses, continuation_token = await query_status_page(
+            client, cutoff, min(page_size, max_instances - indexed), continuation_token
+        )
+        if not statuses:
+            break
+
+        indexed += save_status_records([build_status_record(status) for status in statuses])
+        results = await asyncio.gather(*(client.purge_instance_history(status.instance_id) for status in statuses))
+        purged += sum(result.instances_deleted for result in results)
+
+        if continuation_token is None:
+            break
+
+    summary = {
+        "cutoff": cutoff.isoformat(),
+        "indexed": indexed,
+        "purged": purged,
+    }
+    logging.info(f"task_hub_maintenance.py: Task hub maintenance finished: {summary}")
+    return summary
@@ -0,0 +1,204 @@
+import math
+import re
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import List, Optional
+
+# Paragraph roles returned by Document Intelligence layout models that never carry document content
+BOILERPLATE_ROLES = {"pageHeader", "pageFooter", "pageNumber"}
+
+# A block that is only a page number: "3", "Page 3", "3 of 10", "Page 3/10"
+PAGE_NUMBER_PATTERN = re.compile(r"^(?:page\s*)?(\d+)(?:\s*(?:of|/)\s*\d+)?$", re.IGNORECASE)
+# Page-number wording inside a line: "Page 3", "Page 3 of 10", "3 of 10", "3/10"
+PAGE_REFERENCE_PATTERN = re.compile(r"\bpage\s*(\d+)(?:\s*(?:of|/)\s*\d+)?\b|\b(\d+)\s*(?:of|/)\s*\d+\b", re.IGNORECASE)
+INLINE_WHITESPACE_PATTERN = re.compile(r"[ \t ]+")
+BLANK_LINES_PATTERN = re.compile(r"\n\s*\n+")
+
+# Repeated lines longer than this are treated as content, not boilerplate
+MAX_BOILERPLATE_LENGTH = 150
+# Only the first/last blocks of a page are header/footer candidates, so repeated
+# short values in the body (e.g. "N/A" in a form) are never removed
+EDGE_BLOCKS_PER_PAGE = 2
+# On pages with fewer blocks every block is at an edge, so repeats there cannot be told apart from content
+MIN_BLOCKS_FOR_REPEATS = 2 * EDGE_BLOCKS_PER_PAGE + 1
+
+
+@dataclass
+class TextBlock:
+    content: str
+    page: int
+    role: Optional[str] = None
+
+
+@dataclass
+class TokenReductionOptions:
+    enabled: bool = True
+    keep_tables: bool = True
+    repeat_ratio: float = 0.5
+    min_repeat_pages: int = 3
+    # Off for blocks without printed pages (local Office extraction): only whitespace is normalized
+    remove_page_boilerplate: bool = True
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            enabled=config.read_env_boolean("TEXT_COMPACTION_ENABLED", True),
+            keep_tables=config.read_env_boolean("TEXT_COMPACTION_KEEP_TABLES", True),
+            repeat_ratio=float(config.get_value("TEXT_COMPACTION_REPEAT_RATIO", "0.5")),
+            min_repeat_pages=int(config.get_value("TEXT_COMPACTION_MIN_REPEAT_PAGES", "3")),
+        )
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used for before/after reporting."""
+    return math.ceil(len(text) / 4)
+
+
+def normalize_whitespace(text: str) -> str:
+    lines = [INLINE_WHITESPACE_PATTERN.sub(" ", line).strip() for line in text.splitlines()]
+    return BLANK_LINES_PATTERN.sub("\n", "\n".join(lines)).strip()
+
+
+def _boilerplate_key(content: str, page: int) -> str:
+    # Page numbers ("Confidential - Page 3 of 10") should not hide repetition. Only numbers in
+    # page-number wording that match the block's page are masked; other numbers (dates, amounts) stay.
+    def mask(match):
+        number = match.group(1) or match.group(2)
+        return "<page>" if int(number) == page else match.group()
+    return PAGE_REFERENCE_PATTERN.sub(mask, normalize_whitespace(content).lower())
+
+
+def _is_page_number(content: str, page: int) -> bool:
+    match = PAGE_NUMBER_PATTERN.match(content)
+    return bool(match) and int(match.group(1)) == page
+
+
+def _is_repeat_candidate(block: TextBlock) -> bool:
+    # Table rows (a column header row repeated on every page) are content, not running headers
+    content = block.content.strip()
+    is_table_row = content.startswith("|") and content.endswith("|")
+    return block.role != "table" and not is_table_row and len(content) <= MAX_BOILERPLATE_LENGTH
+
+
+def find_edge_blocks(blocks: List[TextBlock], min_page_blocks: int = 1) -> set:
+    """Return the indexes of the first and last EDGE_BLOCKS_PER_PAGE blocks of every page with at least `min_page_blocks` blocks."""
+    indexes_by_page = defaultdict(list)
+    for index, block in enumerate(blocks):
+        indexes_by_page[block.page].append(index)
+    edges = set()
+    for indexes in indexes_by_page.values():
+        if len(indexes) < min_page_blocks:
+            continue
+        edges.update(indexes[:EDGE_BLOCKS_PER_PAGE])
+        edges.update(indexes[-EDGE_BLOCKS_PER_PAGE:])
+    return edges
+
+
+def find_repeated_blocks(blocks: List[TextBlock], edges: set, options: TokenReductionOptions) -> set:
+    """Return the keys of short page-edge blocks that repeat on enough pages to be considered boilerplate."""
+    total_pages = len({block.page for block in blocks})
+    pages_by_key = defaultdict(set)
+    for index in edges:
+        block = blocks[index]
+        if _is_repeat_candidate(block):
+            pages_by_key[_boilerplate_key(block.content, block.page)].add(block.page)
+
+    threshold = max(options.min_repeat_pages, math.ceil(options.repeat_ratio * total_pages))
+    return {key for key, pages in pages_by_key.items() if len(pages) >= threshold}
+
+
+def table_to_markdown(table) -> str:
+    """Render a Document Intelligence table as compact markdown (no padding, one line per row)."""
+    rows = [[""] * table.column_count for _ in range(table.row_count)]
+    for cell in table.cells:
+        rows[cell.row_index][cell.column_index] = normalize_whitespace(cell.content).replace("\n", " ").replace("|", "\\|")
+    lines = ["|" + "|".join(row) + "|" for row in rows]
+    if lines:
+        lines.insert(1, "|" + "|".join(["-"] * table.column_count) + "|")
+    return "\n".join(lines)
+
+
+def _span_offset(element) -> int:
+    return element.spans[0].offset if element.spans else 0
+
+
+def _page_number(element) -> int:
+    return element.bounding_regions[0].page_number if element.bounding_regions else 0
+
+
+def _in_spans(offset: int, spans) -> bool:
+    return any(span.offset <= offset < span.offset + span.length for span in spans)
+
+
+def blocks_from_analyze_result(result, options: TokenReductionOptions) -> List[TextBlock]:
+    """
+    Convert a Document Intelligence AnalyzeResult into ordered text blocks.
+
+    When `keep_tables` is set and the model returned tables (layout models do, prebuilt-read does not),
+    each table becomes a single markdown block and the paragraphs inside it are dropped.
+    """
+    tables = (result.tables or []) if options.keep_tables else []
+    table_spans = [span for table in tables for span in table.spans]
+
+    items = []
+    for paragraph in result.paragraphs or []:
+        offset = _span_offset(paragraph)
+        if table_spans and _in_spans(offset, table_spans):
+            continue
+        items.append((offset, TextBlock(paragraph.content, _page_number(paragraph), paragraph.role)))
+    for table in tables:
+        items.append((_span_offset(table), TextBlock(table_to_markdown(table), _page_number(table), "table")))
+
+    return [block for _, block in sorted(items, key=lambda item: item[0])]
+
+
+def reduce_tokens(blocks: List[TextBlock], options: TokenReductionOptions):
+    """
+    Drop page boilerplate from extracted text blocks and normalize whitespace.
+
+    Blocks are removed when their role marks them as a page header, footer or number, when a
+    block at the top or bottom of a page is just that page's number, or when the same short text
+    appears at the top or bottom of at least `min_repeat_pages` pages and `repeat_ratio` of all
+    pages (running headers, footers, repeated signature blocks). Repeats are only looked for on
+    pages with at least MIN_BLOCKS_FOR_REPEATS blocks. With `remove_page_boilerplate` off, only
+    role-based removal and whitespace normalization apply. If reduction would leave no text, the
+    unreduced text is returned instead.
+
+    response:
+        tuple: (text, stats) where stats reports estimated tokens before and after and the blocks removed.
+    """
+    original_text = "\n".join(block.content for block in blocks)
+    if not options.enabled:
+        tokens = estimate_tokens(original_text)
+        return original_text, {"tokens_before": tokens, "tokens_after": tokens, "blocks_removed": 0}
+
+    edges = find_edge_blocks(blocks) if options.remove_page_boilerplate else set()
+    repeat_edges = find_edge_blocks(blocks, MIN_BLOCKS_FOR_REPEATS) if options.remove_page_boilerplate else set()
+    repeated = find_repeated_blocks(blocks, repeat_edges, options)
+    kept = []
+    for index, block in enumerate(blocks):
+        if block.role in BOILERPLATE_ROLES:
+            continue
+        content = block.content if block.role == "table" else normalize_whitespace(block.content)
+        if not content:
+            continue
+        # Standalone numbers in the body (amounts, years) are content; only page edges carry page numbers
+        if index in edges and _is_page_number(content, block.page):
+            continue
+        if index in repeat_edges and _is_repeat_candidate(block) and _boilerplate_key(content, block.page) in repeated:
+            continue
+        kept.append(content)
+
+    text = "\n".join(kept)
+    if not text.strip() and original_text.strip():
+        # Everything looked like boilerplate; sending it all beats failing the document
+        logging.warning(f"token_reduction.py: Reduction removed all {len(blocks)} blocks, using the unreduced text")
+        text, kept = original_text, blocks
+    stats = {
+        "tokens_before": estimate_tokens(original_text),
+        "tokens_after": estimate_tokens(text),
+        "blocks_removed": len(blocks) - len(kept),
+    }
+    logging.info(f"token_reduction.py: Reduced estimated prompt tokens from {stats['tokens_before']} to {stats['tokens_after']} ({stats['blocks_removed']} blocks removed)")
+    return text, stats